@@ -6,6 +6,7 @@ import datetime
 import json
 import csv
 import os
+import re
 import sys
 import time
 import logging
@@ -24,6 +25,9 @@ if hasattr(config,'allowed_exceptions'):
         allowlisted_errors_temp.append(allowlisted_errors[error_number-1])
     allowlisted_errors = allowlisted_errors_temp
 
+# Single-pass match against any allowlisted ERPNext error message
+allowlisted_errors_re = re.compile('|'.join(re.escape(error) for error in allowlisted_errors)) if allowlisted_errors else None
+
 device_punch_values_IN = getattr(config, 'device_punch_values_IN', [0,4])
 device_punch_values_OUT = getattr(config, 'device_punch_values_OUT', [1,5])
 ERPNEXT_VERSION = getattr(config, 'ERPNEXT_VERSION', 14)
@@ -197,12 +201,13 @@ def pull_process_and_push_data(device, device_attendance_logs=None):
     if is_re_sync_mode:
         # In re-sync mode: process ALL logs, then filter by date range
         try:
-            start_date = datetime.datetime.strptime(re_sync_date_range[0], "%Y%m%d").date()
-            end_date = datetime.datetime.strptime(re_sync_date_range[1], "%Y%m%d").date()
+            # Parse the bounds once as datetimes: [start 00:00, day after end 00:00)
+            range_start_dt = datetime.datetime.strptime(re_sync_date_range[0], "%Y%m%d")
+            range_end_dt = datetime.datetime.strptime(re_sync_date_range[1], "%Y%m%d") + datetime.timedelta(days=1)
 
             # Filter ALL logs by date range (ignore index_of_last)
             filtered_logs = [log for log in device_attendance_logs
-                           if start_date <= log['timestamp'].date() <= end_date]
+                           if range_start_dt <= log['timestamp'] < range_end_dt]
 
             info_logger.info(f"Device {device['device_id']}: Re-sync mode - Date range filter applied [{re_sync_date_range[0]} to {re_sync_date_range[1]}], "
                            f"processing {len(filtered_logs)} logs (from {len(device_attendance_logs)} total logs)")
@@ -228,8 +233,14 @@ def pull_process_and_push_data(device, device_attendance_logs=None):
             # No new records
             info_logger.info(f"Device {device['device_id']}: Fetched {total_logs} logs, No new records, range: {range_start} to {range_end}")
     
+    # Read device fields once instead of per log record
+    device_id = device['device_id']
+    device_punch_direction = device['punch_direction']
+    device_latitude = device['latitude']
+    device_longitude = device['longitude']
+
     for device_attendance_log in filtered_logs:
-        punch_direction = device['punch_direction']
+        punch_direction = device_punch_direction
         if punch_direction == 'AUTO':
             if device_attendance_log['punch'] in device_punch_values_OUT:
                 punch_direction = 'OUT'
@@ -255,7 +266,7 @@ def pull_process_and_push_data(device, device_attendance_logs=None):
             print(f"IGNORED: User ID {device_attendance_log['user_id']} - logged to user_id_inorged_log.txt at {datetime.datetime.now()}")
             continue
         
-        erpnext_status_code, erpnext_message = send_to_erpnext(device_attendance_log['user_id'], device_attendance_log['timestamp'], device['device_id'], punch_direction, latitude=device['latitude'], longitude=device['longitude'])
+        erpnext_status_code, erpnext_message = send_to_erpnext(device_attendance_log['user_id'], device_attendance_log['timestamp'], device_id, punch_direction, latitude=device_latitude, longitude=device_longitude)
         if erpnext_status_code == 200:
             attendance_success_logger.info("\t".join([erpnext_message, str(device_attendance_log['uid']),
                 str(device_attendance_log['user_id']), str(device_attendance_log['timestamp'].timestamp()),
@@ -263,7 +274,7 @@ def pull_process_and_push_data(device, device_attendance_logs=None):
                 json.dumps(device_attendance_log, default=str)]))
         else:
             # Check for specific error types for custom logging
-            if "This employee already has a log with the same timestamp" in erpnext_message:
+            if DUPLICATE_EMPLOYEE_CHECKIN_ERROR_MESSAGE in erpnext_message:
                 # Skip all duplicate logging - just log to info and continue silently
                 info_logger.info(f"Skipping duplicate - User ID {device_attendance_log['user_id']} at {device_attendance_log['timestamp']}")
 
@@ -286,7 +297,7 @@ def pull_process_and_push_data(device, device_attendance_logs=None):
                             str(device_attendance_log['uid']),
                             str(device_attendance_log['user_id']),
                             str(device_attendance_log['timestamp']),
-                            device['device_id'],
+                            device_id,
                             json.dumps(device_attendance_log, default=str)
                         ]) + "\n")
 
@@ -300,7 +311,7 @@ def pull_process_and_push_data(device, device_attendance_logs=None):
                             '',  # ID is empty
                             device_attendance_log['user_id'],
                             device_attendance_log['timestamp'],
-                            device['device_id']
+                            device_id
                         ])
                     
                     print(f"INACTIVE: User ID {device_attendance_log['user_id']} - logged to separate files at {datetime.datetime.now()}")
@@ -320,7 +331,7 @@ def pull_process_and_push_data(device, device_attendance_logs=None):
                     str(device_attendance_log['punch']), str(device_attendance_log['status']),
                     json.dumps(device_attendance_log, default=str)]))
 
-            if not(any(error in erpnext_message for error in allowlisted_errors)):
+            if not (allowlisted_errors_re and allowlisted_errors_re.search(erpnext_message)):
                 raise Exception('API Call to ERPNext Failed.')
 
 
@@ -559,8 +570,7 @@ def check_re_sync_mode():
 # User will manually set re_sync_data_date_range = [] after completion
 
 # setup logger and status
-if not os.path.exists(config.LOGS_DIRECTORY):
-    os.makedirs(config.LOGS_DIRECTORY)
+os.makedirs(config.LOGS_DIRECTORY, exist_ok=True)
 error_logger = setup_logger('error_logger', '/'.join([config.LOGS_DIRECTORY, 'error.log']), logging.ERROR)
 info_logger = setup_logger('info_logger', '/'.join([config.LOGS_DIRECTORY, 'logs.log']))
 status = PickleDB('/'.join([config.LOGS_DIRECTORY, 'status.json']))
@@ -590,6 +600,7 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Sync attendance logs from devices to ERPNext')
     parser.add_argument('--loop', action='store_true', help='Run in infinite loop mode')
     args = parser.parse_args()
+    config.print_startup_banner()
 
     if args.loop:
         infinite_loop()
@@ -6,6 +6,7 @@ Sync attendance data from MongoDB to ERPNext Employee Checkin
 import requests
 import json
 import os
+import re
 from pymongo import MongoClient, ASCENDING
 from bson import ObjectId
 from datetime import datetime, timezone, timedelta
@@ -67,6 +68,9 @@ REQUEST_TIMEOUT = 10  # Request timeout in seconds
 # File lưu ObjectId cuối cùng đã sync thành công (watermark để tránh re-process)
 LAST_SYNCED_ID_FILE = os.path.join(current_dir, 'logs', 'last_synced_mongodb_id.txt')
 
+# Duplicate checkin response from ERPNext (compiled once, case-insensitive)
+DUPLICATE_LOG_RE = re.compile(r"already has a log", re.I)
+
 # Global session for connection pooling
 session = None
 
@@ -182,7 +186,7 @@ def process_record(record, user_id_ignored_set):
 
     if status_code == 200:
         return ('processed', None, record.get('_id'))
-    elif "already has a log" in str(response).lower():
+    elif DUPLICATE_LOG_RE.search(str(response)):
         return ('skipped', None, record.get('_id'))
     else:
         error_detail = {
@@ -202,6 +206,7 @@ def sync_attendance_data(date_range=None):
         date_range (list): Optional [from_date, to_date] in YYYYMMDD format.
                           Defaults to last 7 days if not provided.
     """
+    global session
     try:
         # Connect to MongoDB
         client = connect_to_mongodb()
@@ -275,7 +280,6 @@ def sync_attendance_data(date_range=None):
 
         if not records:
             client.close()
-            global session
             if session:
                 session.close()
                 session = None
@@ -324,7 +328,6 @@ def sync_attendance_data(date_range=None):
         client.close()
 
         # Close session when done
-        global session
         if session:
             session.close()
             session = None
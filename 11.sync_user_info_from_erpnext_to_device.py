@@ -1,16 +1,24 @@
 #!/usr/bin/env python3
 
 import datetime
+import errno
+import functools
 import logging
 import os
+import queue
 import sys
+import threading
 import concurrent.futures
+import contextlib
 from concurrent.futures import ThreadPoolExecutor
+import select
 import socket
 import time
-import base64
+import binascii
+import hashlib
 from zk import ZK
 from zk.base import Finger
+from zk.user import User
 try:
     from unidecode import unidecode
     UNIDECODE_AVAILABLE = True
@@ -44,18 +52,92 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# TCP connect timeout (seconds) for the device reachability probe; devices are on the LAN
+DEVICE_PROBE_TIMEOUT = 1
+
+# Use TCP for device sessions (UDP fallback); set USE_TCP = False in local_config for old firmware
+USE_TCP = getattr(local_config, 'USE_TCP', True)
+
+# Users per HR_save_usertemplates request in the bulk sync paths
+TEMPLATE_BATCH_SIZE = 20
+
+# Blank templates for all 10 fingers, shared by every clear operation. pyzk
+# takes the uid from the User passed to save_user_template, not from Finger.
+EMPTY_FINGERS = [Finger(uid=0, fid=finger_index, valid=False, template=b'') for finger_index in range(10)]
+
+@functools.lru_cache(maxsize=4096)
+def _shorten_name(full_name, max_length=24):
+    """Convert Vietnamese to non-accented characters and shorten if needed for device compatibility
+
+    Memoized: the same names are shortened for every device on each sync.
+    """
+    if not full_name:
+        return full_name
+        
+    # Always normalize Vietnamese characters for device compatibility
+    if UNIDECODE_AVAILABLE:
+        text_processed = unidecode(full_name)  # 'Nguyễn Văn A' → 'Nguyen Van A'
+    else:
+        text_processed = full_name  # Fallback if unidecode not available
+    # Split once: the parts normalize whitespace and feed the initials
+    parts = text_processed.split()
+    text_processed = ' '.join(parts)
+    
+    if len(text_processed) > max_length:
+        if len(parts) > 1:
+            initials = "".join(part[0].upper() for part in parts[:-1])
+            last_part = parts[-1]
+            return f"{initials} {last_part}"
+        else:
+            return text_processed[:max_length]
+    else:
+        return text_processed
+
 class ERPNextSyncToDeviceStandalone:
     def __init__(self):
         self.base_url = local_config.ERPNEXT_URL
         self.api_key = local_config.ERPNEXT_API_KEY
         self.api_secret = local_config.ERPNEXT_API_SECRET
         self.devices = local_config.devices
-        self.max_workers = min(len(self.devices), 10)
+        self.max_workers = max(1, min(len(self.devices), 10))
+        # One worker pool for the per-device fan-out, reused by sync_full and sync_changed
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dev-sync")
         
         self.api_client = ERPNextAPIClient(self.base_url, self.api_key, self.api_secret)
         self.sync_state = SyncState()
+        # Reachability per device_id from the last probe_all_devices() call
+        self.device_reachable = {}
+        # Per-device state files are written by one background thread, off the device workers' path
+        self._writer_q = queue.Queue()
+        self._writer = threading.Thread(target=self._drain_state_writes, daemon=True)
+        self._writer.start()
         self.setup_logging()
         
+    def _drain_state_writes(self):
+        """Run queued SyncState writes in order (background thread)"""
+        while True:
+            item = self._writer_q.get()
+            if item is None:  # sentinel from close()
+                self._writer_q.task_done()
+                return
+            write, args = item
+            try:
+                write(*args)
+            except Exception as e:
+                logger.error(f"Error writing sync state: {str(e)}")
+            finally:
+                self._writer_q.task_done()
+    
+    def queue_state_write(self, write, *args):
+        """Queue a SyncState write; flushed with self._writer_q.join() at the end of a sync"""
+        self._writer_q.put((write, args))
+
+    def close(self):
+        """Stop the worker pool and the state writer thread (call once the run is over)"""
+        self._pool.shutdown(wait=True)
+        self._writer_q.put(None)
+        self._writer.join()
+    
     def setup_logging(self):
         # Ensure sync logs directory exists
         os.makedirs(sync_logs_dir, exist_ok=True)
@@ -87,12 +169,127 @@ class ERPNextSyncToDeviceStandalone:
         return self.api_client.get_employee_fingerprint_count(employee_id)
     
     
+    def probe_all_devices(self):
+        """Probe all devices once per sync run and cache the results
+
+        Starts a non-blocking TCP connect to every device and waits for all of
+        them in a single select() on this thread, up to DEVICE_PROBE_TIMEOUT.
+        """
+        self.device_reachable = {device['device_id']: False for device in self.devices}
+        pending = {}
+        
+        for device in self.devices:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                result = sock.connect_ex((device['ip'], 4370))
+                if result in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    pending[sock] = device
+                else:
+                    sock.close()
+            except Exception as e:
+                logger.error(f"Error checking device connection {device['device_id']}: {str(e)}")
+        
+        deadline = time.monotonic() + DEVICE_PROBE_TIMEOUT
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _, writable, failed = select.select([], list(pending), list(pending), remaining)
+                for sock in set(writable) | set(failed):
+                    device = pending.pop(sock)
+                    self.device_reachable[device['device_id']] = (
+                        sock not in failed and sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                    )
+                    sock.close()
+        finally:
+            for sock in pending:
+                sock.close()
+        
+        return self.device_reachable
+    
+    def prefetch_all(self):
+        """Fetch active and Left employees from ERPNext while probing and connecting to devices
+
+        The two HTTP requests run concurrently with the device probes; once the
+        probes finish, connections to the reachable devices are opened on the
+        worker pool while ERPNext is still responding.
+
+        Returns:
+            tuple: (employees, left_employees, {device_id: conn or None})
+        """
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="prefetch") as executor:
+            employees_future = executor.submit(self.get_all_employees_with_fingerprints)
+            left_future = executor.submit(self.get_left_employees_with_device_id)
+            probe_future = executor.submit(self.probe_all_devices)
+            probe_future.result()
+            conn_futures = {
+                device['device_id']: self._pool.submit(self.open_device_connection, device)
+                for device in self.devices
+                if self.device_reachable.get(device['device_id'])
+            }
+            try:
+                employees, left_employees = employees_future.result(), left_future.result()
+            except Exception:
+                # Do not leave device sessions open (they block 01.sync_log) when ERPNext fails
+                for future in conn_futures.values():
+                    conn = future.result()
+                    if conn:
+                        with contextlib.suppress(Exception):
+                            conn.disconnect()
+                raise
+        
+        connections = {device_id: future.result() for device_id, future in conn_futures.items()}
+        return employees, left_employees, connections
+    
+    def open_device_connection(self, device_config):
+        """Connect to a device ahead of its sync; None if the connection fails"""
+        try:
+            return self.connect_device(device_config['ip'])
+        except Exception as e:
+            logger.warning(f"Could not pre-connect to device {device_config['device_id']}: {str(e)}")
+            return None
+    
+    def disable_device_for_sync(self, conn, device_config, reconnect=False):
+        """Disable the device before a sync and return the connection to use
+
+        A connection opened by prefetch_all sat idle through the ERPNext fetch;
+        with reconnect=True it is replaced once if the first disable_device()
+        fails. The connection is closed if it cannot be disabled.
+        """
+        try:
+            conn.disable_device()
+            return conn
+        except Exception as e:
+            with contextlib.suppress(Exception):
+                conn.disconnect()
+            if not reconnect:
+                raise
+            logger.warning(f"Pre-opened connection to {device_config['device_id']} went stale ({str(e)}), reconnecting")
+        
+        conn = self.connect_device(device_config['ip'])
+        try:
+            conn.disable_device()
+        except Exception:
+            with contextlib.suppress(Exception):
+                conn.disconnect()
+            raise
+        return conn
+    
     def check_device_connection(self, device_config):
-        """Check if device is reachable"""
+        """Check if device is reachable (cached result of probe_all_devices when available)"""
+        reachable = self.device_reachable.get(device_config['device_id'])
+        if reachable is not None:
+            return reachable
+        return self.probe_device(device_config)
+    
+    def probe_device(self, device_config):
+        """Open a TCP connection to the device port to check it is reachable"""
         try:
             ip_address = device_config['ip']
             port = 4370
-            timeout = 3
+            timeout = DEVICE_PROBE_TIMEOUT
             
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(timeout)
@@ -105,28 +302,171 @@ class ERPNextSyncToDeviceStandalone:
             logger.error(f"Error checking device connection {device_config['device_id']}: {str(e)}")
             return False
     
+    @contextlib.contextmanager
+    def device_session(self, conn):
+        """Re-enable and disconnect the device when the block exits, whatever happens"""
+        try:
+            yield conn
+        finally:
+            with contextlib.suppress(Exception):
+                conn.enable_device()
+            with contextlib.suppress(Exception):
+                conn.disconnect()
+    
+    def connect_device(self, ip_address, timeout=10):
+        """Connect to the device, over TCP when local_config.USE_TCP is set
+
+        TCP frames template uploads far better than UDP's per-chunk ack/retry.
+        Falls back to UDP for firmware that does not accept TCP.
+        """
+        if USE_TCP:
+            try:
+                conn = ZK(ip_address, port=4370, timeout=timeout, force_udp=False, ommit_ping=True).connect()
+                if conn:
+                    return conn
+            except Exception as e:
+                logger.warning(f"TCP connect to {ip_address} failed ({str(e)}), retrying over UDP")
+        return ZK(ip_address, port=4370, timeout=timeout, force_udp=True, ommit_ping=True).connect()
+    
     def shorten_name(self, full_name, max_length=24):
         """Convert Vietnamese to non-accented characters and shorten if needed for device compatibility"""
-        if not full_name:
-            return full_name
-            
-        # Always normalize Vietnamese characters for device compatibility
-        if UNIDECODE_AVAILABLE:
-            text_processed = unidecode(full_name)  # 'Nguyễn Văn A' → 'Nguyen Van A'
-        else:
-            text_processed = full_name  # Fallback if unidecode not available
-        text_processed = ' '.join(text_processed.split()).strip()
-        
-        if len(text_processed) > max_length:
-            parts = text_processed.split()
-            if len(parts) > 1:
-                initials = "".join(part[0].upper() for part in parts[:-1])
-                last_part = parts[-1]
-                return f"{initials} {last_part}"
-            else:
-                return text_processed[:max_length]
-        else:
-            return text_processed
+        return _shorten_name(full_name, max_length)
+    
+    def decode_employee_fingerprints(self, employee_data):
+        """Decode an employee's base64 templates into {finger_index: bytes}
+
+        Cached on employee_data["decoded_fingerprints"], so each template is
+        decoded once per sync run however many devices it is sent to.
+        """
+        decoded_templates = employee_data.get("decoded_fingerprints")
+        if decoded_templates is None:
+            decoded_templates = {}
+            for fp in employee_data.get("fingerprints", []):
+                if fp.get("template_data"):
+                    try:
+                        # a2b_base64 directly: b64decode only adds a str->bytes wrapper
+                        decoded_templates[fp.get("finger_index")] = binascii.a2b_base64(fp["template_data"])
+                    except (binascii.Error, ValueError, TypeError):
+                        pass
+            employee_data["decoded_fingerprints"] = decoded_templates
+        return decoded_templates
+    
+    def employee_fingers(self, employee_data):
+        """Finger objects for an employee's templates, built in the decode pass
+
+        Cached on employee_data["fingers"] and shared by every device: pyzk
+        takes the uid from the User passed to save_user_template, not from Finger.
+        """
+        fingers = employee_data.get("fingers")
+        if fingers is None:
+            fingers = [
+                Finger(uid=0, fid=finger_index, valid=True, template=template_data)
+                for finger_index, template_data in self.decode_employee_fingerprints(employee_data).items()
+            ]
+            employee_data["fingers"] = fingers
+        return fingers
+    
+    def device_finger_ids(self, conn):
+        """Finger indexes stored on the device per uid, from one get_templates() read
+
+        Returns None when the templates cannot be read, so callers resend
+        instead of trusting the stored hashes.
+        """
+        try:
+            finger_ids = {}
+            for finger in conn.get_templates():
+                finger_ids.setdefault(finger.uid, set()).add(finger.fid)
+            return finger_ids
+        except Exception as e:
+            logger.warning(f"Could not read templates from device: {str(e)}")
+            return None
+    
+    def employee_sync_hash(self, employee_data):
+        """Content hash of the user record and templates written for an employee
+
+        Cached on employee_data["sync_hash"] and compared with the hash stored
+        per device, to skip employees unchanged since their last sync.
+        """
+        sync_hash = employee_data.get("sync_hash")
+        if sync_hash is None:
+            h = hashlib.sha256()
+            for field in (employee_data["attendance_device_id"],
+                          self.shorten_name(employee_data["employee_name"], 24),
+                          employee_data.get("privilege", 0),
+                          employee_data.get("password", "") or ''):
+                h.update(str(field).encode('utf-8'))
+                h.update(b'\0')
+            decoded_templates = self.decode_employee_fingerprints(employee_data)
+            for finger_index in sorted(decoded_templates):
+                template_data = decoded_templates[finger_index]
+                h.update(f"{finger_index}:{len(template_data)}:".encode('utf-8'))
+                h.update(template_data)
+            sync_hash = h.hexdigest()
+            employee_data["sync_hash"] = sync_hash
+        return sync_hash
+    
+    def save_templates_batch(self, conn, pending_bulk, use_bulk):
+        """Upload templates for several users
+
+        pending_bulk is a list of [User, [Finger, ...]]. Uses one
+        HR_save_usertemplates request when use_bulk is set, otherwise (or if
+        the bulk request fails) one save_user_template per user.
+
+        Returns:
+            tuple: ({user_id: error} for users not saved,
+                    whether to keep using the bulk request on this connection)
+        """
+        if not pending_bulk:
+            return {}, use_bulk
+        if use_bulk:
+            try:
+                conn.HR_save_usertemplates(pending_bulk)
+                return {}, True
+            except Exception as e:
+                logger.warning(f"Bulk template upload failed ({str(e)}), saving per user on this connection")
+                use_bulk = False
+        
+        errors = {}
+        for user, templates_to_send in pending_bulk:
+            try:
+                conn.save_user_template(user, templates_to_send)
+            except Exception as e:
+                errors[user.user_id] = str(e)
+        return errors, use_bulk
+    
+    def create_device_user(self, conn, employee_data, uid, user_map):
+        """Delete (if present) and re-create an employee's user on an open connection
+
+        user_map ({str(user_id): User}) is read once per connection and updated
+        in place here, instead of re-reading the device user table per employee.
+        """
+        attendance_device_id = employee_data["attendance_device_id"]
+        
+        # Delete existing user (delete_user returns after the device ACK). Pass the
+        # uid: without it pyzk reads the whole user table to look it up
+        existing = user_map.pop(str(attendance_device_id), None)
+        if existing:
+            conn.delete_user(uid=existing.uid, user_id=attendance_device_id)
+        
+        # Create user
+        full_name = employee_data["employee_name"]
+        shortened_name = self.shorten_name(full_name, 24)
+        password = employee_data.get("password", "") or ''
+        privilege = employee_data.get("privilege", 0)
+        
+        conn.set_user(
+            uid=uid,
+            name=shortened_name,
+            privilege=privilege,
+            password=password,
+            group_id='',
+            user_id=attendance_device_id
+        )
+        
+        # set_user raises on failure, so the new user is recorded locally
+        user = User(uid, shortened_name, privilege, password, '', str(attendance_device_id))
+        user_map[str(attendance_device_id)] = user
+        return user
     
     def sync_employee_to_device(self, device_config, employee_data):
         """Sync single employee to single device"""
@@ -143,8 +483,7 @@ class ERPNextSyncToDeviceStandalone:
                     "message": f"Device {device_id} ({ip_address}) is not reachable"
                 }
             
-            zk = ZK(ip_address, port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
+            conn = self.connect_device(ip_address)
             
             if not conn:
                 return {
@@ -155,68 +494,23 @@ class ERPNextSyncToDeviceStandalone:
                     "message": f"Failed to connect to device {device_id}"
                 }
                 
-            try:
+            with self.device_session(conn):
                 conn.disable_device()
                 
                 attendance_device_id = employee_data["attendance_device_id"]
                 
-                existing_users = conn.get_users()
-                user_exists = any(str(u.user_id) == str(attendance_device_id) for u in existing_users)
-                
-                if user_exists:
-                    conn.delete_user(user_id=attendance_device_id)
-                    time.sleep(0.1)
-                
-                full_name = employee_data["employee_name"]
-                shortened_name = self.shorten_name(full_name, 24)
-                password = employee_data.get("password", "")
-                privilege = employee_data.get("privilege", 0)
-                
-                if password:
-                    conn.set_user(
-                        name=shortened_name,
-                        privilege=privilege,
-                        password=password,
-                        group_id='',
-                        user_id=attendance_device_id
-                    )
+                user_map = {str(u.user_id): u for u in conn.get_users()}
+                existing_user = user_map.get(str(attendance_device_id))
+                if existing_user:
+                    uid = existing_user.uid
                 else:
-                    conn.set_user(
-                        name=shortened_name,
-                        privilege=privilege,
-                        group_id='',
-                        user_id=attendance_device_id
-                    )
-                
-                users = conn.get_users()
-                user = next((u for u in users if str(u.user_id) == str(attendance_device_id)), None)
+                    uid = max((u.uid for u in user_map.values()), default=0) + 1
                 
-                if not user:
-                    return {
-                        "success": False,
-                        "device_id": device_id,
-                        "ip": ip_address,
-                        "employee": employee_data["employee"],
-                        "message": f"Could not create or find user {attendance_device_id}"
-                    }
-                
-                fingerprint_lookup = {fp.get("finger_index"): fp for fp in employee_data["fingerprints"] if fp.get("template_data")}
-                
-                decoded_templates = {}
-                for finger_index, fp in fingerprint_lookup.items():
-                    try:
-                        decoded_templates[finger_index] = base64.b64decode(fp["template_data"])
-                    except Exception:
-                        pass
+                user = self.create_device_user(conn, employee_data, uid, user_map)
                 
                 # Only send templates that have actual data
-                templates_to_send = []
-                fingerprint_count = 0
-                
-                for finger_index, template_data in decoded_templates.items():
-                    finger_obj = Finger(uid=user.uid, fid=finger_index, valid=True, template=template_data)
-                    templates_to_send.append(finger_obj)
-                    fingerprint_count += 1
+                templates_to_send = self.employee_fingers(employee_data)
+                fingerprint_count = len(templates_to_send)
                 
                 # Only save if we have templates to send
                 if templates_to_send:
@@ -229,13 +523,6 @@ class ERPNextSyncToDeviceStandalone:
                     "employee": employee_data["employee"],
                     "message": f"Successfully synced {fingerprint_count} fingerprints for user {attendance_device_id}"
                 }
-                
-            finally:
-                try:
-                    conn.enable_device()
-                    conn.disconnect()
-                except:
-                    pass
                     
         except Exception as e:
             return {
@@ -246,8 +533,12 @@ class ERPNextSyncToDeviceStandalone:
                 "message": f"Sync error: {str(e)}"
             }
     
-    def sync_all_employees_to_device(self, device_config, employees_data):
-        """Sync all employees to single device - optimized approach"""
+    def sync_all_employees_to_device(self, device_config, employees_data, force=False):
+        """Sync all employees to single device - optimized approach
+
+        Employees unchanged since their last sync to this device (and still on
+        it with the same fingers) are skipped unless force is True.
+        """
         device_id = device_config['device_id']
         ip_address = device_config['ip']
         
@@ -267,8 +558,7 @@ class ERPNextSyncToDeviceStandalone:
                 }
             
             # Connect once
-            zk = ZK(ip_address, port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
+            conn = self.connect_device(ip_address)
             
             if not conn:
                 logger.warning(f"✗ Failed to connect to device {device_id}")
@@ -281,7 +571,7 @@ class ERPNextSyncToDeviceStandalone:
                     "message": f"Failed to connect to device {device_id}"
                 }
             
-            try:
+            with self.device_session(conn):
                 # Disable device once
                 conn.disable_device()
                 logger.info(f"Device {device_id} disabled, processing {len(employees_data)} employees...")
@@ -290,83 +580,76 @@ class ERPNextSyncToDeviceStandalone:
                 failed_employees = []
                 synced_users = []
                 
-                # Process all employees in this connection
-                for i, employee_data in enumerate(employees_data, 1):
-                    try:
-                        attendance_device_id = employee_data["attendance_device_id"]
-                        
-                        # Delete existing user
-                        existing_users = conn.get_users()
-                        user_exists = any(str(u.user_id) == str(attendance_device_id) for u in existing_users)
-                        if user_exists:
-                            conn.delete_user(user_id=attendance_device_id)
-                            time.sleep(0.1)
-                        
-                        # Create user
-                        full_name = employee_data["employee_name"]
-                        shortened_name = self.shorten_name(full_name, 24)
-                        password = employee_data.get("password", "")
-                        privilege = employee_data.get("privilege", 0)
-                        
-                        if password:
-                            conn.set_user(
-                                name=shortened_name,
-                                privilege=privilege,
-                                password=password,
-                                group_id='',
-                                user_id=attendance_device_id
-                            )
-                        else:
-                            conn.set_user(
-                                name=shortened_name,
-                                privilege=privilege,
-                                group_id='',
-                                user_id=attendance_device_id
-                            )
-                        
-                        # Get user and save templates
-                        users = conn.get_users()
-                        user = next((u for u in users if str(u.user_id) == str(attendance_device_id)), None)
-                        
-                        if user:
-                            fingerprint_lookup = {fp.get("finger_index"): fp for fp in employee_data["fingerprints"] if fp.get("template_data")}
+                # Get existing users on device once
+                user_map = {str(u.user_id): u for u in conn.get_users()}
+                next_uid = max((u.uid for u in user_map.values()), default=0) + 1
+                # pyzk 0.9 (the current release) has no HR_save_usertemplates
+                use_bulk = hasattr(conn, 'HR_save_usertemplates')
+                device_hashes = {} if force else self.sync_state.load_device_hashes(device_id)
+                # Templates changed on the device (15.sync, cleaners, re-enrollment) defeat the hash skip
+                device_fids = self.device_finger_ids(conn) if device_hashes else None
+                unchanged_count = 0
+                
+                # Process all employees in this connection, uploading templates
+                # TEMPLATE_BATCH_SIZE users at a time
+                for start in range(0, len(employees_data), TEMPLATE_BATCH_SIZE):
+                    pending = []  # (employee_data, user_key, sync_hash, [User, [Finger, ...]])
+                    
+                    for i, employee_data in enumerate(employees_data[start:start + TEMPLATE_BATCH_SIZE], start + 1):
+                        try:
+                            user_key = str(employee_data["attendance_device_id"])
+                            sync_hash = self.employee_sync_hash(employee_data)
+                            existing_user = user_map.get(user_key)
                             
-                            decoded_templates = {}
-                            for finger_index, fp in fingerprint_lookup.items():
-                                try:
-                                    decoded_templates[finger_index] = base64.b64decode(fp["template_data"])
-                                except Exception:
-                                    pass
+                            # Unchanged since the last sync and still on the device with the same fingers
+                            if (existing_user and device_hashes.get(user_key) == sync_hash and device_fids is not None
+                                    and device_fids.get(existing_user.uid, set()) == {f.fid for f in self.employee_fingers(employee_data)}):
+                                unchanged_count += 1
+                                synced_count += 1
+                                synced_users.append(employee_data)
+                                continue
                             
-                            # Only send templates that have actual data
-                            templates_to_send = []
-                            fingerprint_count = 0
+                            device_hashes.pop(user_key, None)
+                            if existing_user:
+                                uid = existing_user.uid
+                            else:
+                                uid = next_uid
+                                next_uid += 1
+                            
+                            user = self.create_device_user(conn, employee_data, uid, user_map)
                             
-                            for finger_index, template_data in decoded_templates.items():
-                                finger_obj = Finger(uid=user.uid, fid=finger_index, valid=True, template=template_data)
-                                templates_to_send.append(finger_obj)
-                                fingerprint_count += 1
+                            # Only send templates that have actual data
+                            templates_to_send = self.employee_fingers(employee_data)
                             
-                            # Only save if we have templates to send
                             if templates_to_send:
-                                conn.save_user_template(user, templates_to_send)
-                            synced_count += 1
-                            synced_users.append(employee_data)  # Track successful sync
+                                pending.append((employee_data, user_key, sync_hash, [user, templates_to_send]))
+                            else:
+                                synced_count += 1
+                                synced_users.append(employee_data)  # Track successful sync
+                                device_hashes[user_key] = sync_hash
                             
                             if i % 10 == 0:
                                 logger.info(f"  {device_id}: {i}/{len(employees_data)} processed...")
+                                
+                        except Exception as e:
+                            failed_employees.append(f"{employee_data['employee']} ({str(e)})")
+                    
+                    errors, use_bulk = self.save_templates_batch(conn, [user_templates for _, _, _, user_templates in pending], use_bulk)
+                    for employee_data, user_key, sync_hash, _ in pending:
+                        if user_key in errors:
+                            failed_employees.append(f"{employee_data['employee']} ({errors[user_key]})")
                         else:
-                            failed_employees.append(f"{employee_data['employee']} (user not found)")
-                            
-                    except Exception as e:
-                        failed_employees.append(f"{employee_data['employee']} ({str(e)})")
+                            synced_count += 1
+                            synced_users.append(employee_data)  # Track successful sync
+                            device_hashes[user_key] = sync_hash
                 
-                logger.info(f"✓ Device {device_id}: {synced_count}/{len(employees_data)} employees synced")
+                logger.info(f"✓ Device {device_id}: {synced_count}/{len(employees_data)} employees synced ({unchanged_count} unchanged)")
                 if failed_employees:
                     logger.warning(f"✗ Device {device_id} failed employees: {len(failed_employees)}")
                 
                 # Save device-specific sync results
-                self.sync_state.save_device_sync_result(device_id, synced_users)
+                self.queue_state_write(self.sync_state.save_device_sync_result, device_id, synced_users)
+                self.queue_state_write(self.sync_state.save_device_hashes, device_id, device_hashes)
                 
                 return {
                     "device_id": device_id,
@@ -375,16 +658,8 @@ class ERPNextSyncToDeviceStandalone:
                     "synced_count": synced_count,
                     "total_count": len(employees_data),
                     "failed_employees": failed_employees,
-                    "synced_users": synced_users,
                     "message": f"Synced {synced_count}/{len(employees_data)} employees"
                 }
-                
-            finally:
-                try:
-                    conn.enable_device()
-                    conn.disconnect()
-                except:
-                    pass
                     
         except Exception as e:
             logger.error(f"✗ Device {device_id} sync error: {str(e)}")
@@ -418,8 +693,7 @@ class ERPNextSyncToDeviceStandalone:
                 }
             
             # Connect once
-            zk = ZK(ip_address, port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
+            conn = self.connect_device(ip_address)
             
             if not conn:
                 logger.warning(f"✗ Failed to connect to device {device_id}")
@@ -432,7 +706,7 @@ class ERPNextSyncToDeviceStandalone:
                     "message": f"Failed to connect to device {device_id}"
                 }
             
-            try:
+            with self.device_session(conn):
                 # Disable device once
                 conn.disable_device()
                 logger.info(f"Device {device_id} disabled, clearing templates for {len(left_employees)} Left employees...")
@@ -455,10 +729,7 @@ class ERPNextSyncToDeviceStandalone:
                             user = existing_user_ids[attendance_device_id]
                             
                             # Clear all fingerprint templates (set empty templates)
-                            empty_templates = []
-                            for j in range(10):
-                                finger_obj = Finger(uid=user.uid, fid=j, valid=False, template=b'')
-                                empty_templates.append(finger_obj)
+                            empty_templates = EMPTY_FINGERS
                             
                             conn.save_user_template(user, empty_templates)
                             cleared_count += 1
@@ -481,7 +752,8 @@ class ERPNextSyncToDeviceStandalone:
                 
                 # Save device-specific clear results
                 if cleared_users:
-                    self.sync_state.save_device_clear_result(device_id, cleared_users)
+                    self.queue_state_write(self.sync_state.save_device_clear_result, device_id, cleared_users)
+                    self.queue_state_write(self.sync_state.forget_device_hashes, device_id, [e["attendance_device_id"] for e in cleared_users])
                 
                 return {
                     "device_id": device_id,
@@ -490,16 +762,8 @@ class ERPNextSyncToDeviceStandalone:
                     "cleared_count": cleared_count,
                     "total_count": len(left_employees),
                     "failed_employees": failed_employees,
-                    "cleared_users": cleared_users,
                     "message": f"Cleared templates for {cleared_count}/{len(left_employees)} Left employees"
                 }
-                
-            finally:
-                try:
-                    conn.enable_device()
-                    conn.disconnect()
-                except:
-                    pass
                     
         except Exception as e:
             logger.error(f"✗ Device {device_id} clear error: {str(e)}")
@@ -512,48 +776,57 @@ class ERPNextSyncToDeviceStandalone:
                 "message": f"Device clear error: {str(e)}"
             }
     
-    def sync_and_clear_device(self, device_config, employees_data, left_employees):
-        """Sync active employees and clear Left employees in single connection"""
+    def sync_and_clear_device(self, device_config, employees_data, left_employees, force=False, conn=None):
+        """Sync active employees and clear Left employees in single connection
+
+        Active employees unchanged since their last sync to this device (and
+        still on it with the same fingers) are skipped unless force is True. conn is a connection
+        already opened by prefetch_all; without one the device is connected here.
+        """
         device_id = device_config['device_id']
         ip_address = device_config['ip']
         
         logger.info(f"Syncing {len(employees_data)} employees and clearing {len(left_employees)} Left employees on device {device_id}")
+        # Per-user lines are tagged with the device (workers log concurrently) and skipped entirely below INFO
+        log_users = logger.isEnabledFor(logging.INFO)
+        tag = f"{device_id}@{ip_address}"
         
+        preconnected = conn is not None
         try:
-            # Check connection once
-            if not self.check_device_connection(device_config):
-                logger.warning(f"✗ Device {device_id} ({ip_address}) is not reachable")
-                return {
-                    "device_id": device_id,
-                    "ip": ip_address,
-                    "success": False,
-                    "synced_count": 0,
-                    "cleared_count": 0,
-                    "total_sync_count": len(employees_data),
-                    "total_clear_count": len(left_employees),
-                    "message": f"Device {device_id} is not reachable"
-                }
-            
-            # Connect once for both operations
-            zk = ZK(ip_address, port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
-            
-            if not conn:
-                logger.warning(f"✗ Failed to connect to device {device_id}")
-                return {
-                    "device_id": device_id,
-                    "ip": ip_address,
-                    "success": False,
-                    "synced_count": 0,
-                    "cleared_count": 0,
-                    "total_sync_count": len(employees_data),
-                    "total_clear_count": len(left_employees),
-                    "message": f"Failed to connect to device {device_id}"
-                }
+            if conn is None:
+                # Check connection once
+                if not self.check_device_connection(device_config):
+                    logger.warning(f"✗ Device {device_id} ({ip_address}) is not reachable")
+                    return {
+                        "device_id": device_id,
+                        "ip": ip_address,
+                        "success": False,
+                        "synced_count": 0,
+                        "cleared_count": 0,
+                        "total_sync_count": len(employees_data),
+                        "total_clear_count": len(left_employees),
+                        "message": f"Device {device_id} is not reachable"
+                    }
+                
+                # Connect once for both operations
+                conn = self.connect_device(ip_address)
+                
+                if not conn:
+                    logger.warning(f"✗ Failed to connect to device {device_id}")
+                    return {
+                        "device_id": device_id,
+                        "ip": ip_address,
+                        "success": False,
+                        "synced_count": 0,
+                        "cleared_count": 0,
+                        "total_sync_count": len(employees_data),
+                        "total_clear_count": len(left_employees),
+                        "message": f"Failed to connect to device {device_id}"
+                    }
             
-            try:
-                # Disable device once
-                conn.disable_device()
+            # Disable device once
+            conn = self.disable_device_for_sync(conn, device_config, reconnect=preconnected)
+            with self.device_session(conn):
                 logger.info(f"Device {device_id} disabled, processing {len(employees_data)} active and {len(left_employees)} Left employees...")
                 
                 synced_count = 0
@@ -564,103 +837,108 @@ class ERPNextSyncToDeviceStandalone:
                 failed_clears = []
                 
                 # Get existing users on device once
-                existing_users = conn.get_users()
-                existing_user_ids = {str(u.user_id): u for u in existing_users}
+                existing_user_ids = {str(u.user_id): u for u in conn.get_users()}
+                next_uid = max((u.uid for u in existing_user_ids.values()), default=0) + 1
+                # pyzk 0.9 (the current release) has no HR_save_usertemplates
+                use_bulk = hasattr(conn, 'HR_save_usertemplates')
+                device_hashes = {} if force else self.sync_state.load_device_hashes(device_id)
+                # Templates changed on the device (15.sync, cleaners, re-enrollment) defeat the hash skip
+                device_fids = self.device_finger_ids(conn) if device_hashes else None
+                unchanged_count = 0
                 
-                # PART 1: Sync active employees
-                for i, employee_data in enumerate(employees_data, 1):
-                    try:
-                        attendance_device_id = employee_data["attendance_device_id"]
-                        
-                        # Delete existing user if exists
-                        if attendance_device_id in existing_user_ids:
-                            conn.delete_user(user_id=attendance_device_id)
-                            time.sleep(0.1)
-                        
-                        # Create user
-                        full_name = employee_data["employee_name"]
-                        shortened_name = self.shorten_name(full_name, 24)
-                        password = employee_data.get("password", "")
-                        privilege = employee_data.get("privilege", 0)
-                        
-                        if password:
-                            conn.set_user(name=shortened_name, privilege=privilege, password=password, group_id='', user_id=attendance_device_id)
-                        else:
-                            conn.set_user(name=shortened_name, privilege=privilege, group_id='', user_id=attendance_device_id)
-                        
-                        # Get user and save templates
-                        users = conn.get_users()
-                        user = next((u for u in users if str(u.user_id) == str(attendance_device_id)), None)
-                        
-                        if user:
-                            fingerprint_lookup = {fp.get("finger_index"): fp for fp in employee_data["fingerprints"] if fp.get("template_data")}
+                # PART 1: Sync active employees, uploading templates TEMPLATE_BATCH_SIZE users at a time
+                for start in range(0, len(employees_data), TEMPLATE_BATCH_SIZE):
+                    pending = []  # (employee_data, user_key, sync_hash, [User, [Finger, ...]])
+                    
+                    for i, employee_data in enumerate(employees_data[start:start + TEMPLATE_BATCH_SIZE], start + 1):
+                        try:
+                            user_key = str(employee_data["attendance_device_id"])
+                            sync_hash = self.employee_sync_hash(employee_data)
+                            existing_user = existing_user_ids.get(user_key)
+                            
+                            # Unchanged since the last sync and still on the device with the same fingers
+                            if (existing_user and device_hashes.get(user_key) == sync_hash and device_fids is not None
+                                    and device_fids.get(existing_user.uid, set()) == {f.fid for f in self.employee_fingers(employee_data)}):
+                                unchanged_count += 1
+                                synced_count += 1
+                                synced_users.append(employee_data)
+                                continue
                             
-                            decoded_templates = {}
-                            for finger_index, fp in fingerprint_lookup.items():
-                                try:
-                                    decoded_templates[finger_index] = base64.b64decode(fp["template_data"])
-                                except Exception:
-                                    pass
+                            device_hashes.pop(user_key, None)
+                            if existing_user:
+                                uid = existing_user.uid
+                            else:
+                                uid = next_uid
+                                next_uid += 1
+                            
+                            user = self.create_device_user(conn, employee_data, uid, existing_user_ids)
                             
                             # Only send templates that have actual data
-                            templates_to_send = []
-                            for finger_index, template_data in decoded_templates.items():
-                                finger_obj = Finger(uid=user.uid, fid=finger_index, valid=True, template=template_data)
-                                templates_to_send.append(finger_obj)
+                            templates_to_send = self.employee_fingers(employee_data)
                             
-                            # Only save if we have templates to send
                             if templates_to_send:
-                                conn.save_user_template(user, templates_to_send)
-                            
-                            synced_count += 1
-                            synced_users.append(employee_data)
+                                pending.append((employee_data, user_key, sync_hash, [user, templates_to_send]))
+                            else:
+                                synced_count += 1
+                                synced_users.append(employee_data)
+                                device_hashes[user_key] = sync_hash
                             
                             if i % 10 == 0:
                                 logger.info(f"  {device_id}: {i}/{len(employees_data)} active employees processed...")
+                                
+                        except Exception as e:
+                            failed_syncs.append(f"{employee_data['employee']} ({str(e)})")
+                    
+                    errors, use_bulk = self.save_templates_batch(conn, [user_templates for _, _, _, user_templates in pending], use_bulk)
+                    for employee_data, user_key, sync_hash, _ in pending:
+                        if user_key in errors:
+                            failed_syncs.append(f"{employee_data['employee']} ({errors[user_key]})")
                         else:
-                            failed_syncs.append(f"{employee_data['employee']} (user not found)")
-                            
-                    except Exception as e:
-                        failed_syncs.append(f"{employee_data['employee']} ({str(e)})")
+                            synced_count += 1
+                            synced_users.append(employee_data)
+                            device_hashes[user_key] = sync_hash
                 
                 # PART 2: Clear Left employees (device templates only)
                 if left_employees:
                     logger.info(f"  Processing {len(left_employees)} Left employees for template clearing...")
                     
-                    # Refresh user list after syncing active employees
-                    existing_users = conn.get_users()
-                    existing_user_ids = {str(u.user_id): u for u in existing_users}
+                    # existing_user_ids already reflects the users created in PART 1
                     
-                    for i, employee_data in enumerate(left_employees, 1):
-                        try:
-                            attendance_device_id = str(employee_data["attendance_device_id"])
-                            
-                            # Clear templates from device (if user exists)
-                            logger.info(f"  Clearing device templates for {employee_data['employee']}")
-                            if attendance_device_id in existing_user_ids:
-                                user = existing_user_ids[attendance_device_id]
-                                
-                                # Clear all fingerprint templates (set empty templates)
-                                empty_templates = []
-                                for j in range(10):
-                                    finger_obj = Finger(uid=user.uid, fid=j, valid=False, template=b'')
-                                    empty_templates.append(finger_obj)
-                                
-                                conn.save_user_template(user, empty_templates)
-                                logger.info(f"    ✓ Device: Cleared templates (kept user_id {attendance_device_id})")
+                    for start in range(0, len(left_employees), TEMPLATE_BATCH_SIZE):
+                        pending = []  # (employee_data, attendance_device_id, [User, EMPTY_FINGERS])
+                        
+                        for employee_data in left_employees[start:start + TEMPLATE_BATCH_SIZE]:
+                            try:
+                                attendance_device_id = str(employee_data["attendance_device_id"])
+                                device_hashes.pop(attendance_device_id, None)
                                 
+                                # Clear templates from device (if user exists)
+                                if log_users:
+                                    logger.info(f"  {tag}: Clearing device templates for {employee_data['employee']}")
+                                if attendance_device_id in existing_user_ids:
+                                    # Clear all fingerprint templates (set empty templates)
+                                    pending.append((employee_data, attendance_device_id,
+                                                    [existing_user_ids[attendance_device_id], EMPTY_FINGERS]))
+                                elif log_users:
+                                    logger.info(f"    • {tag}: User {attendance_device_id} not found (skipped)")
+                                    
+                            except Exception as e:
+                                failed_clears.append(f"{employee_data['employee']} ({str(e)})")
+                                logger.error(f"    ✗ {tag}: Error processing {employee_data['employee']}: {str(e)}")
+                        
+                        errors, use_bulk = self.save_templates_batch(conn, [user_templates for _, _, user_templates in pending], use_bulk)
+                        for employee_data, attendance_device_id, _ in pending:
+                            if attendance_device_id in errors:
+                                failed_clears.append(f"{employee_data['employee']} ({errors[attendance_device_id]})")
+                                logger.error(f"    ✗ {tag}: Error processing {employee_data['employee']}: {errors[attendance_device_id]}")
+                            else:
+                                if log_users:
+                                    logger.info(f"    ✓ {tag}: Cleared templates (kept user_id {attendance_device_id})")
                                 # Mark as successful clear
                                 cleared_count += 1
                                 cleared_users.append(employee_data)
-                                
-                            else:
-                                logger.info(f"    • Device: User {attendance_device_id} not found (skipped)")
-                                
-                        except Exception as e:
-                            failed_clears.append(f"{employee_data['employee']} ({str(e)})")
-                            logger.error(f"    ✗ Error processing {employee_data['employee']}: {str(e)}")
                 
-                logger.info(f"✓ Device {device_id}: Synced {synced_count}/{len(employees_data)} active, Cleared {cleared_count}/{len(left_employees)} Left employees")
+                logger.info(f"✓ Device {device_id}: Synced {synced_count}/{len(employees_data)} active ({unchanged_count} unchanged), Cleared {cleared_count}/{len(left_employees)} Left employees")
                 if failed_syncs:
                     logger.warning(f"✗ Device {device_id} failed syncs: {len(failed_syncs)}")
                 if failed_clears:
@@ -668,9 +946,10 @@ class ERPNextSyncToDeviceStandalone:
                 
                 # Save device-specific results
                 if synced_users:
-                    self.sync_state.save_device_sync_result(device_id, synced_users)
+                    self.queue_state_write(self.sync_state.save_device_sync_result, device_id, synced_users)
                 if cleared_users:
-                    self.sync_state.save_device_clear_result(device_id, cleared_users)
+                    self.queue_state_write(self.sync_state.save_device_clear_result, device_id, cleared_users)
+                self.queue_state_write(self.sync_state.save_device_hashes, device_id, device_hashes)
                 
                 return {
                     "device_id": device_id,
@@ -682,17 +961,8 @@ class ERPNextSyncToDeviceStandalone:
                     "total_clear_count": len(left_employees),
                     "failed_syncs": failed_syncs,
                     "failed_clears": failed_clears,
-                    "synced_users": synced_users,
-                    "cleared_users": cleared_users,
                     "message": f"Synced {synced_count}/{len(employees_data)} active, Cleared {cleared_count}/{len(left_employees)} Left"
                 }
-                
-            finally:
-                try:
-                    conn.enable_device()
-                    conn.disconnect()
-                except:
-                    pass
                     
         except Exception as e:
             logger.error(f"✗ Device {device_id} sync+clear error: {str(e)}")
@@ -707,8 +977,12 @@ class ERPNextSyncToDeviceStandalone:
                 "message": f"Device sync+clear error: {str(e)}"
             }
     
-    def sync_full(self):
-        """Sync all employees with fingerprints to all devices"""
+    def sync_full(self, force=False):
+        """Sync all employees with fingerprints to all devices
+
+        Args:
+            force (bool): Re-send every employee, ignoring stored content hashes
+        """
         start_time = time.time()
         logger.info("=" * 80)
         logger.info("STARTING FULL SYNC FROM ERPNEXT TO DEVICES (STANDALONE)")
@@ -723,9 +997,16 @@ class ERPNextSyncToDeviceStandalone:
                 "execution_time": 0
             }
         
-        employees = self.get_all_employees_with_fingerprints()
+        # Fetch employees while probing and connecting to every device; per-device steps reuse the probe result
+        employees, left_employees, connections = self.prefetch_all()
         
         if not employees:
+            for conn in connections.values():
+                if conn:
+                    try:
+                        conn.disconnect()
+                    except:
+                        pass
             logger.warning("No employees with fingerprint data found")
             return {
                 "success": False,
@@ -738,45 +1019,67 @@ class ERPNextSyncToDeviceStandalone:
         logger.info(f"Starting optimized sync for {len(employees)} employees to {len(self.devices)} devices")
         
         # Also clear Left employees during sync
-        left_employees = self.get_left_employees_with_device_id()
         if left_employees:
             logger.info(f"Found {len(left_employees)} Left employees to clear templates")
         
+        # Decode templates into Finger objects once, before fanning out to devices
+        for employee_data in employees:
+            self.employee_fingers(employee_data)
+        
         # Sync to all devices in parallel - one connection per device for all employees
         device_results = []
-        with ThreadPoolExecutor(max_workers=len(self.devices)) as executor:
-            future_to_device = {
-                executor.submit(self.sync_and_clear_device, device, employees, left_employees): device 
-                for device in self.devices
-            }
-            
-            for future in concurrent.futures.as_completed(future_to_device):
-                device = future_to_device[future]
-                try:
-                    result = future.result()
-                    device_results.append(result)
-                    
-                    if result["success"]:
-                        sync_msg = f"{result.get('synced_count', 0)}/{result.get('total_sync_count', 0)} synced"
-                        clear_msg = f"{result.get('cleared_count', 0)}/{result.get('total_clear_count', 0)} cleared"
-                        logger.info(f"✓ {device['device_id']}: {sync_msg}, {clear_msg}")
-                    else:
-                        logger.warning(f"✗ {device['device_id']}: {result['message']}")
-                        
-                except Exception as e:
-                    error_result = {
-                        "device_id": device['device_id'],
-                        "success": False,
-                        "synced_count": 0,
-                        "total_count": len(employees),
-                        "message": f"Thread execution error: {str(e)}"
-                    }
-                    device_results.append(error_result)
-                    logger.error(f"✗ {device['device_id']}: Thread execution error: {str(e)}")
+        total_synced = 0
+        successful_devices = 0
+        
+        # Devices that failed the probe are reported here, without taking a worker
+        reachable_devices = []
+        for device in self.devices:
+            if self.check_device_connection(device):
+                reachable_devices.append(device)
+            else:
+                logger.warning(f"✗ {device['device_id']}: Device {device['device_id']} is not reachable")
+                device_results.append({
+                    "device_id": device['device_id'],
+                    "ip": device['ip'],
+                    "success": False,
+                    "synced_count": 0,
+                    "cleared_count": 0,
+                    "total_sync_count": len(employees),
+                    "total_clear_count": len(left_employees),
+                    "message": f"Device {device['device_id']} is not reachable"
+                })
+        
+        future_to_device = {
+            self._pool.submit(self.sync_and_clear_device, device, employees, left_employees, force,
+                              connections.get(device['device_id'])): device 
+            for device in reachable_devices
+        }
         
-        # Calculate totals
-        total_synced = sum(r["synced_count"] for r in device_results)
-        successful_devices = sum(1 for r in device_results if r["success"])
+        for future in concurrent.futures.as_completed(future_to_device):
+            device = future_to_device[future]
+            try:
+                result = future.result()
+                device_results.append(result)
+                total_synced += result["synced_count"]
+                
+                if result["success"]:
+                    successful_devices += 1
+                    sync_msg = f"{result.get('synced_count', 0)}/{result.get('total_sync_count', 0)} synced"
+                    clear_msg = f"{result.get('cleared_count', 0)}/{result.get('total_clear_count', 0)} cleared"
+                    logger.info(f"✓ {device['device_id']}: {sync_msg}, {clear_msg}")
+                else:
+                    logger.warning(f"✗ {device['device_id']}: {result['message']}")
+                    
+            except Exception as e:
+                error_result = {
+                    "device_id": device['device_id'],
+                    "success": False,
+                    "synced_count": 0,
+                    "total_count": len(employees),
+                    "message": f"Thread execution error: {str(e)}"
+                }
+                device_results.append(error_result)
+                logger.error(f"✗ {device['device_id']}: Thread execution error: {str(e)}")
         
         execution_time = time.time() - start_time
         
@@ -788,7 +1091,8 @@ class ERPNextSyncToDeviceStandalone:
         logger.info(f"Total execution time: {execution_time:.2f} seconds")
         logger.info("=" * 80)
         
-        # Save last sync timestamp
+        # Wait for queued device state writes, then save last sync timestamp
+        self._writer_q.join()
         self.sync_state.set_last_sync()
         
         return {
@@ -847,7 +1151,12 @@ class ERPNextSyncToDeviceStandalone:
                     if modified_dt > since_datetime:
                         # Employee has changes, check fingerprint count
                         try:
-                            fingerprint_count = self.get_employee_fingerprint_count(employee_id)
+                            # Count from the templates already fetched with the employee;
+                            # only query ERPNext again if they were not included
+                            if "fingerprints" in employee:
+                                fingerprint_count = sum(1 for fp in employee["fingerprints"] if fp.get("template_data"))
+                            else:
+                                fingerprint_count = self.get_employee_fingerprint_count(employee_id)
                             
                             if fingerprint_count <= 0:
                                 logger.info(f"Employee {employee.get('attendance_device_id')} {employee.get('employee')} {employee.get('employee_name')} marked for CLEAR_ALL (no fingerprints)")
@@ -881,13 +1190,12 @@ class ERPNextSyncToDeviceStandalone:
             if not self.check_device_connection(device_config):
                 return {"success": False, "message": f"Device {device_id} not reachable"}
             
-            zk = ZK(ip_address, port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
+            conn = self.connect_device(ip_address)
             
             if not conn:
                 return {"success": False, "message": f"Failed to connect to device {device_id}"}
             
-            try:
+            with self.device_session(conn):
                 conn.disable_device()
                 
                 # Check if user exists
@@ -914,15 +1222,11 @@ class ERPNextSyncToDeviceStandalone:
                             
                             # Delete and recreate user
                             conn.delete_user(user_id=user_id)
-                            time.sleep(0.1)
                             conn.set_user(name=user_name, privilege=user_privilege, user_id=user_id)
                         except Exception as fallback_error:
                             logger.warning(f"    Fallback clear method failed: {fallback_error}")
                             # Last resort: set empty templates
-                            empty_templates = []
-                            for finger_index in range(10):
-                                finger_obj = Finger(uid=user.uid, fid=finger_index, valid=False, template=b'')
-                                empty_templates.append(finger_obj)
+                            empty_templates = EMPTY_FINGERS
                             conn.save_user_template(user, empty_templates)
                     logger.info(f"  ✓ Cleared all fingerprints for {employee_data['attendance_device_id']} {employee_data['employee']} {employee_data['employee_name']} on device {device_id}")
                     return {"success": True, "message": "All fingerprints cleared"}
@@ -930,13 +1234,6 @@ class ERPNextSyncToDeviceStandalone:
                     logger.info(f"  • User {attendance_device_id} not found on device {device_id}")
                     return {"success": True, "message": "User not found (already cleared)"}
                     
-            finally:
-                try:
-                    conn.enable_device()
-                    conn.disconnect()
-                except:
-                    pass
-                    
         except Exception as e:
             return {"success": False, "message": f"Clear error: {str(e)}"}
     
@@ -950,13 +1247,12 @@ class ERPNextSyncToDeviceStandalone:
             if not self.check_device_connection(device_config):
                 return {"success": False, "message": f"Device {device_id} not reachable"}
             
-            zk = ZK(ip_address, port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
+            conn = self.connect_device(ip_address)
             
             if not conn:
                 return {"success": False, "message": f"Failed to connect to device {device_id}"}
             
-            try:
+            with self.device_session(conn):
                 conn.disable_device()
                 
                 # Check if user exists
@@ -968,7 +1264,7 @@ class ERPNextSyncToDeviceStandalone:
                     return {"success": True, "message": "User not found"}
                 
                 # Get ERPNext fingerprints
-                erpnext_fingers = {fp.get("finger_index"): fp for fp in employee_data["fingerprints"] if fp.get("template_data")}
+                erpnext_fingers = self.decode_employee_fingerprints(employee_data)
                 erpnext_finger_indexes = set(erpnext_fingers.keys())
                 
                 # Get device fingerprints (simplified - we'll clear all and re-sync for now)
@@ -978,22 +1274,15 @@ class ERPNextSyncToDeviceStandalone:
                 # Find fingers to clear (on device but not in ERPNext)
                 fingers_to_clear = device_finger_indexes - erpnext_finger_indexes
                 
-                # Prepare templates to send
-                templates_to_send = []
-                
-                # Clear deleted fingers
-                for finger_index in fingers_to_clear:
-                    finger_obj = Finger(uid=user.uid, fid=finger_index, valid=False, template=b'')
-                    templates_to_send.append(finger_obj)
-                
-                # Add existing fingers from ERPNext
-                for finger_index, fp in erpnext_fingers.items():
-                    try:
-                        decoded_template = base64.b64decode(fp["template_data"])
-                        finger_obj = Finger(uid=user.uid, fid=finger_index, valid=True, template=decoded_template)
-                        templates_to_send.append(finger_obj)
-                    except Exception as e:
-                        logger.warning(f"  Failed to decode template for finger {finger_index}: {e}")
+                # Prepare templates to send: deleted fingers are cleared, the rest come from ERPNext
+                templates_to_send = [
+                    Finger(uid=user.uid, fid=finger_index, valid=False, template=b'')
+                    for finger_index in fingers_to_clear
+                ]
+                templates_to_send.extend(
+                    Finger(uid=user.uid, fid=finger_index, valid=True, template=decoded_template)
+                    for finger_index, decoded_template in erpnext_fingers.items()
+                )
                 
                 # Save all templates
                 if templates_to_send:
@@ -1006,13 +1295,6 @@ class ERPNextSyncToDeviceStandalone:
                 
                 return {"success": True, "message": f"Selective sync: {sync_count} synced, {clear_count} cleared"}
                     
-            finally:
-                try:
-                    conn.enable_device()
-                    conn.disconnect()
-                except:
-                    pass
-                    
         except Exception as e:
             return {"success": False, "message": f"Selective sync error: {str(e)}"}
     
@@ -1071,8 +1353,11 @@ class ERPNextSyncToDeviceStandalone:
         
         logger.info(f"Syncing changes since: {since_datetime}")
         
-        # Get changed employees
-        changed_employees = self.get_changed_employees_with_fingerprints(since_datetime)
+        # Get changed employees while probing every device once; per-device steps reuse the probe result
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch") as executor:
+            probe_future = executor.submit(self.probe_all_devices)
+            changed_employees = self.get_changed_employees_with_fingerprints(since_datetime)
+            probe_future.result()
         
         if not changed_employees:
             logger.info("No employees with changes found")
@@ -1093,43 +1378,55 @@ class ERPNextSyncToDeviceStandalone:
             changed_employees, since_datetime
         )
         
+        # Decode templates once, before fanning out to devices
+        for employee_data in employees_to_sync:
+            self.decode_employee_fingerprints(employee_data)
+        
         # Process each category in parallel across devices
         device_results = []
+        total_operations = 0
+        successful_devices = 0
         
-        with ThreadPoolExecutor(max_workers=len(self.devices)) as executor:
-            # Submit tasks for each device
-            future_to_device = {}
-            
-            for device in self.devices:
-                future = executor.submit(self.process_device_smart_sync, device, 
-                                       employees_to_sync, employees_to_clear_all, left_employees_to_cleanup)
-                future_to_device[future] = device
-            
-            # Collect results
-            for future in concurrent.futures.as_completed(future_to_device):
-                device = future_to_device[future]
-                try:
-                    result = future.result()
-                    device_results.append(result)
-                    
-                    if result["success"]:
-                        logger.info(f"✓ {device['device_id']}: {result['message']}")
-                    else:
-                        logger.warning(f"✗ {device['device_id']}: {result['message']}")
-                        
-                except Exception as e:
-                    error_result = {
-                        "device_id": device['device_id'],
-                        "success": False,
-                        "total_operations": 0,
-                        "message": f"Thread execution error: {str(e)}"
-                    }
-                    device_results.append(error_result)
-                    logger.error(f"✗ {device['device_id']}: Thread execution error: {str(e)}")
+        # Submit tasks for each reachable device; devices that failed the probe are reported here
+        future_to_device = {}
+        
+        for device in self.devices:
+            if not self.check_device_connection(device):
+                logger.warning(f"✗ {device['device_id']}: Device {device['device_id']} not reachable")
+                device_results.append({
+                    "device_id": device['device_id'],
+                    "success": False,
+                    "total_operations": 0,
+                    "message": f"Device {device['device_id']} not reachable"
+                })
+                continue
+            future = self._pool.submit(self.process_device_smart_sync, device, 
+                                     employees_to_sync, employees_to_clear_all, left_employees_to_cleanup)
+            future_to_device[future] = device
         
-        # Calculate totals
-        total_operations = sum(r.get("total_operations", 0) for r in device_results)
-        successful_devices = sum(1 for r in device_results if r["success"])
+        # Collect results
+        for future in concurrent.futures.as_completed(future_to_device):
+            device = future_to_device[future]
+            try:
+                result = future.result()
+                device_results.append(result)
+                total_operations += result.get("total_operations", 0)
+                
+                if result["success"]:
+                    successful_devices += 1
+                    logger.info(f"✓ {device['device_id']}: {result['message']}")
+                else:
+                    logger.warning(f"✗ {device['device_id']}: {result['message']}")
+                    
+            except Exception as e:
+                error_result = {
+                    "device_id": device['device_id'],
+                    "success": False,
+                    "total_operations": 0,
+                    "message": f"Thread execution error: {str(e)}"
+                }
+                device_results.append(error_result)
+                logger.error(f"✗ {device['device_id']}: Thread execution error: {str(e)}")
         
         execution_time = time.time() - start_time
         
@@ -1144,7 +1441,8 @@ class ERPNextSyncToDeviceStandalone:
         logger.info(f"Total execution time: {execution_time:.2f} seconds")
         logger.info("=" * 80)
         
-        # Save last sync timestamp
+        # Wait for queued device state writes, then save last sync timestamp
+        self._writer_q.join()
         self.sync_state.set_last_sync()
         
         return {
@@ -1168,7 +1466,8 @@ class ERPNextSyncToDeviceStandalone:
                    f"{len(employees_to_clear_all)} clear all, {len(left_employees_to_cleanup)} left cleanup")
         
         try:
-            # Process selective sync employees
+            # ERPNext reported these employees as modified: always push them, the
+            # stored hashes only decide skips for unchanged employees in a full sync
             for employee in employees_to_sync:
                 result = self.selective_sync_employee_fingerprints(device_config, employee)
                 results.append(f"Selective {employee['employee']}: {result['message']}")
@@ -1189,6 +1488,12 @@ class ERPNextSyncToDeviceStandalone:
                 if result["success"]:
                     total_operations += 1
             
+            # Templates were changed outside a full sync; re-send these next full sync
+            self.queue_state_write(self.sync_state.forget_device_hashes, device_id, [
+                employee["attendance_device_id"]
+                for employee in employees_to_sync + employees_to_clear_all + left_employees_to_cleanup
+            ])
+            
             return {
                 "device_id": device_id,
                 "success": True,
@@ -1225,14 +1530,17 @@ def main():
                        help='Sync mode: full (all employees), changed (only recent changes), or auto (detect based on last_sync)')
     parser.add_argument('--hours', type=int, default=24,
                        help='For changed mode: number of hours back to check for changes (default: 24)')
+    parser.add_argument('--force', action='store_true',
+                       help='For full mode: re-send all employees, even those unchanged since the last sync')
     
     args = parser.parse_args()
     
+    sync_tool = None
     try:
         sync_tool = ERPNextSyncToDeviceStandalone()
         
         if args.mode == 'full':
-            result = sync_tool.sync_full()
+            result = sync_tool.sync_full(force=args.force)
         elif args.mode == 'changed':
             since_datetime = datetime.datetime.now() - datetime.timedelta(hours=args.hours)
             result = sync_tool.sync_changed(since_datetime)
@@ -1249,6 +1557,10 @@ def main():
     except Exception as e:
         logger.error(f"Fatal error during sync: {str(e)}")
         raise
+    finally:
+        # exit() raises SystemExit, so this also runs after a normal return from the menu
+        if sync_tool is not None:
+            sync_tool.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
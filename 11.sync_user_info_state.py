@@ -23,6 +23,36 @@ class SyncState:
         filename = f"last_sync_{device_id.lower()}.json"
         return os.path.join(self.state_dir, filename)
         
+    def get_device_hash_file(self, device_id):
+        """Get device-specific user content hash file path"""
+        filename = f"user_hashes_{device_id.lower()}.json"
+        return os.path.join(self.state_dir, filename)
+        
+    def load_device_hashes(self, device_id):
+        """Get {user_id: content hash} of users last synced to a device"""
+        try:
+            with open(self.get_device_hash_file(device_id), 'r') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    
+    def save_device_hashes(self, device_id, hashes):
+        """Save {user_id: content hash} of users synced to a device"""
+        try:
+            with open(self.get_device_hash_file(device_id), 'w') as f:
+                json.dump(hashes, f)
+            return True
+        except Exception:
+            return False
+    
+    def forget_device_hashes(self, device_id, user_ids):
+        """Drop stored hashes for users whose device data was changed outside a full sync"""
+        hashes = self.load_device_hashes(device_id)
+        removed = [hashes.pop(str(user_id)) for user_id in user_ids if str(user_id) in hashes]
+        if removed:
+            return self.save_device_hashes(device_id, hashes)
+        return True
+        
     def get_last_sync(self):
         """Get global last sync timestamp"""
         try:
@@ -257,6 +257,7 @@ class MasterDeviceToERPNextSync:
             employee_doc['custom_fingerprints'] = []
             
             # Add new fingerprints (only non-empty templates)
+            get_finger_name = config.get_finger_name
             for fp in fingerprints_data:
                 finger_index = fp['finger_index']
                 template_data = fp['template_data']
@@ -266,7 +267,7 @@ class MasterDeviceToERPNextSync:
                     continue
                     
                 # Get finger name from index
-                finger_name = self.get_finger_name(finger_index)
+                finger_name = get_finger_name(finger_index)
                 
                 fingerprint_entry = {
                     'finger_index': finger_index,
@@ -290,11 +291,6 @@ class MasterDeviceToERPNextSync:
         except Exception as e:
             return {"success": False, "message": f"Error: {str(e)}"}
             
-    def get_finger_name(self, finger_index):
-        """Get standardized finger name from index using local_config mapping"""
-        return config.get_finger_name(finger_index)
-        
-        
     def sync_user_to_erpnext(self, user_data):
         """Sync single user from device to ERPNext (Active employees only)"""
         user_id = user_data['user_id']
@@ -6,12 +6,77 @@ Sync all users with fingerprints from master device to target devices
 import local_config as config
 from zk import ZK, const
 from zk.base import Finger
-import time
-import base64
+from zk.user import User
+import os
+import json
+import hashlib
 import logging
+import logging.handlers
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from unidecode import unidecode
 
+# Number of users whose templates are sent to a device in one request
+TEMPLATE_BATCH_SIZE = 20
+
+# Upper bound on device sessions open at the same time
+MAX_DEVICE_WORKERS = 32
+
+# Content hash of each user last synced to each target: {device_id: {user_id: hash}}
+SYNC_HASH_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs', 'sync_all_from_master', 'synced_user_hashes.json')
+
+def connect_device(device, timeout=10):
+    """Connect over TCP, falling back to UDP for firmware without TCP
+
+    TCP carries template transfers in larger frames than UDP.
+    """
+    try:
+        conn = ZK(device['ip'], port=4370, timeout=timeout, force_udp=False, ommit_ping=True).connect()
+        if conn:
+            return conn
+    except Exception:
+        pass
+    return ZK(device['ip'], port=4370, timeout=timeout, force_udp=True, ommit_ping=True).connect()
+
+class DeviceConnectionError(Exception):
+    """Raised when a device connection cannot be opened"""
+    pass
+
+class DeviceSession:
+    """Open a device connection, disabled for the duration of the block
+
+    Enables and disconnects the device on exit, so one session can be
+    reused for every user synced to that device.
+    """
+    
+    def __init__(self, device, timeout=10):
+        self.device = device
+        self.timeout = timeout
+        self.conn = None
+        
+    def __enter__(self):
+        conn = connect_device(self.device, self.timeout)
+        if not conn:
+            raise DeviceConnectionError("Failed to connect")
+        try:
+            conn.disable_device()
+        except Exception:
+            conn.disconnect()
+            raise
+        self.conn = conn
+        return conn
+        
+    def __exit__(self, exc_type, exc_value, tb):
+        # Separate tries: the socket is closed even if re-enabling fails
+        try:
+            self.conn.enable_device()
+        except Exception:
+            pass
+        try:
+            self.conn.disconnect()
+        except Exception:
+            pass
+        return False
+
 class MasterToTargetSync:
     """Sync all fingerprint users from master to target devices"""
     
@@ -19,17 +84,36 @@ class MasterToTargetSync:
         self.setup_logging()
         self.master_device = config.devices_master
         self.target_devices = config.devices
+        # Finger names by device finger index (0-9), for scan log lines
+        self._finger_names = tuple(config.get_finger_name(i) for i in range(10))
+        self.sync_hashes = self.load_sync_hashes()
         
     def setup_logging(self):
         """Setup logging"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.StreamHandler()
-            ]
+        # Buffer records and write them in batches; errors flush immediately
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        self.log_buffer = logging.handlers.MemoryHandler(
+            capacity=256,
+            flushLevel=logging.ERROR,
+            target=stream_handler
         )
+        # Attach to our own logger: basicConfig is a no-op once the root logger has handlers
         self.logger = logging.getLogger(__name__)
+        self.logger.setLevel(logging.INFO)
+        # Drop the buffer left by an earlier run in the same process (menu re-runs)
+        for handler in list(self.logger.handlers):
+            if isinstance(handler, logging.handlers.MemoryHandler):
+                self.logger.removeHandler(handler)
+                handler.close()
+        self.logger.addHandler(self.log_buffer)
+        self.logger.propagate = False
+
+    def close_logging(self):
+        """Flush and detach the log buffer at the end of a run"""
+        self.logger.removeHandler(self.log_buffer)
+        self.log_buffer.close()
+        self.logger.propagate = True
         
     def shorten_name(self, full_name, max_length=24):
         """Shorten name for device compatibility"""
@@ -37,10 +121,11 @@ class MasterToTargetSync:
             return full_name
             
         text_processed = unidecode(full_name)
-        text_processed = ' '.join(text_processed.split()).strip()
+        # Split once: the parts normalize whitespace and feed the initials
+        parts = text_processed.split()
+        text_processed = ' '.join(parts)
         
         if len(text_processed) > max_length:
-            parts = text_processed.split()
             if len(parts) > 1:
                 initials = "".join(part[0].upper() for part in parts[:-1])
                 last_part = parts[-1]
@@ -50,6 +135,36 @@ class MasterToTargetSync:
         else:
             return text_processed
             
+    def load_sync_hashes(self):
+        """Load per-device user hashes from the last successful syncs"""
+        try:
+            with open(SYNC_HASH_FILE, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+            
+    def save_sync_hashes(self):
+        """Persist per-device user hashes"""
+        try:
+            os.makedirs(os.path.dirname(SYNC_HASH_FILE), exist_ok=True)
+            with open(SYNC_HASH_FILE, 'w') as f:
+                json.dump(self.sync_hashes, f)
+        except OSError as e:
+            self.logger.warning(f"⚠️ Could not save sync hashes: {str(e)}")
+            
+    def compute_sync_hash(self, user_data):
+        """Content hash of the user fields and templates written to a device"""
+        h = hashlib.sha1()
+        for field in (user_data['user_id'], user_data.get('shortened_name') or self.shorten_name(user_data['name'], 24),
+                      user_data['privilege'], user_data.get('password') or '', user_data.get('group_id', '')):
+            h.update(str(field).encode('utf-8'))
+            h.update(b'\0')
+        for template in user_data['templates']:
+            template = template or b''
+            h.update(len(template).to_bytes(4, 'little'))
+            h.update(template)
+        return h.hexdigest()
+        
     def get_all_users_with_fingerprints(self):
         """Get all users with fingerprints from master device"""
         self.logger.info(f"🔍 Scanning master device for users with fingerprints...")
@@ -57,8 +172,7 @@ class MasterToTargetSync:
         
         try:
             # Connect to master
-            zk = ZK(self.master_device['ip'], port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
+            conn = connect_device(self.master_device)
             
             if not conn:
                 self.logger.error("❌ Failed to connect to master device")
@@ -70,156 +184,231 @@ class MasterToTargetSync:
             users = conn.get_users()
             self.logger.info(f"👥 Found {len(users)} total users on master device")
             
+            # Fetch all templates in one request and group them by uid;
+            # fall back to per-finger reads if the bulk read fails
+            templates_by_uid = None
+            try:
+                templates_by_uid = {}
+                for template in conn.get_templates():
+                    templates_by_uid.setdefault(template.uid, []).append(template)
+                self.logger.info(f"🧬 Fetched templates for {len(templates_by_uid)} users in bulk")
+            except Exception as e:
+                templates_by_uid = None
+                self.logger.warning(f"⚠️ Bulk template fetch failed ({str(e)}), reading per finger")
+            
             # Find users with fingerprints
             users_with_fingerprints = []
+            finger_names = self._finger_names
+            # Identical templates (re-enrolled fingers, shared test accounts)
+            # are kept in memory once
+            template_pool = {}
+            # Per-user lines are buffered and emitted once per 100 users,
+            # and not built at all when INFO is disabled
+            log_lines = []
+            log_details = self.logger.isEnabledFor(logging.INFO)
             
             for i, user in enumerate(users):
-                if i % 100 == 0:
-                    self.logger.info(f"  Progress: {i}/{len(users)}")
+                if i % 100 == 0 and log_details:
+                    log_lines.append(f"  Progress: {i}/{len(users)}")
+                    self.logger.info("%s", "\n".join(log_lines))
+                    log_lines.clear()
                     
                 try:
-                    # Check each finger individually to get all templates
-                    fingerprints = []
-                    for finger_id in range(10):
-                        try:
-                            template = conn.get_user_template(user.uid, finger_id)
-                            if (template and hasattr(template, 'valid') and 
-                                template.valid and template.template and len(template.template) > 0):
-                                fingerprints.append({
-                                    'finger_index': finger_id,
-                                    'template_data': base64.b64encode(template.template).decode('utf-8')
-                                })
-                        except Exception:
-                            # Skip individual finger errors
-                            pass
+                    if templates_by_uid is not None:
+                        # pop: each Finger wrapper is released once its bytes are taken
+                        user_templates = templates_by_uid.pop(user.uid, ())
+                    else:
+                        user_templates = self.get_user_templates_per_finger(conn, user.uid)
+                        
+                    # Raw template bytes indexed by finger (0-9), None if not enrolled;
+                    # fetch and send run in the same process, so no base64
+                    templates = [None] * 10
+                    for template in user_templates:
+                        # Out-of-range fids are skipped rather than failing the whole user
+                        if getattr(template, 'valid', False) and template.template and 0 <= template.fid < 10:
+                            templates[template.fid] = template_pool.setdefault(template.template, template.template)
+                    fingerprint_count = 10 - templates.count(None)
                                 
-                    if fingerprints:
+                    if fingerprint_count:
                         user_data = {
                             'uid': user.uid,
                             'user_id': user.user_id,
                             'name': user.name,
+                            # Shortened once here rather than per target device
+                            'shortened_name': self.shorten_name(user.name, 24),
                             'privilege': user.privilege,
                             'password': user.password,
                             'group_id': user.group_id,
-                            'fingerprints': fingerprints
+                            'templates': templates
                         }
                         users_with_fingerprints.append(user_data)
                         
                         # Enhanced logging with finger details
-                        finger_details = []
-                        for fp in fingerprints:
-                            finger_name = local_config.get_finger_name(fp['finger_index'])
-                            finger_details.append(f"{fp['finger_index']}:{finger_name}")
-                        
-                        finger_list = ", ".join(finger_details)
-                        self.logger.info(f"  ✅ {user.user_id}: {user.name} ({len(fingerprints)} fingerprints: {finger_list})")
+                        if log_details:
+                            finger_list = ", ".join(
+                                f"{finger_index}:{finger_names[finger_index]}"
+                                for finger_index, template in enumerate(templates)
+                                if template is not None
+                            )
+                            log_lines.append(f"  ✅ {user.user_id}: {user.name} ({fingerprint_count} fingerprints: {finger_list})")
                         
                 except Exception as e:
                     # Skip users with errors
                     pass
                     
+            if log_lines:
+                self.logger.info("%s", "\n".join(log_lines))
+                
             conn.enable_device()
             conn.disconnect()
             
             self.logger.info(f"📊 Found {len(users_with_fingerprints)} users with fingerprints")
+            self.log_buffer.flush()
             return users_with_fingerprints
             
         except Exception as e:
             self.logger.error(f"❌ Error scanning master device: {str(e)}")
             return []
             
-    def sync_user_to_device(self, user_data, target_device):
-        """Sync single user to single target device"""
-        user_id = user_data['user_id']
+    def get_user_templates_per_finger(self, conn, uid):
+        """Read a user's templates one finger at a time (older firmware fallback)"""
+        templates = []
+        for finger_id in range(10):
+            try:
+                template = conn.get_user_template(uid, finger_id)
+                if template:
+                    templates.append(template)
+            except Exception:
+                # Skip individual finger errors
+                pass
+        return templates
+        
+    def sync_device(self, target_device, users_data):
+        """Sync all users to one target device over a single connection
+
+        The target's user table is read once and kept up to date in memory
+        as users are deleted and re-created.
+
+        Returns:
+            tuple: (completed, results) - completed is False when the session
+                   itself failed; results has one dict per user, in users_data order
+        """
         device_id = target_device['device_id']
         
+        def failed_all(message):
+            return False, [{
+                "success": False,
+                "user_id": user_data['user_id'],
+                "device": device_id,
+                "message": message
+            } for user_data in users_data]
+        
         try:
-            # Connect to target
-            zk = ZK(target_device['ip'], port=4370, timeout=10, force_udp=True, ommit_ping=True)
-            conn = zk.connect()
-            
-            if not conn:
-                return {
-                    "success": False,
-                    "user_id": user_id,
-                    "device": device_id,
-                    "message": "Failed to connect"
-                }
+            with DeviceSession(target_device) as conn:
+                # Read the target's users once for the whole run
+                existing_users = {u.user_id: u for u in conn.get_users()}
+                next_uid = max((u.uid for u in existing_users.values()), default=0) + 1
+                device_hashes = self.sync_hashes.get(device_id, {})
                 
-            conn.disable_device()
+                results = []
+                pending_templates = []
+                # pyzk 0.9 (the current release) has no HR_save_usertemplates
+                use_bulk = hasattr(conn, 'HR_save_usertemplates')
+                for user_data in users_data:
+                    user_id = user_data['user_id']
+                    existing_user = existing_users.get(user_id)
+                    
+                    # Unchanged since the last successful sync and still on the device
+                    sync_hash = user_data.get('sync_hash')
+                    if existing_user and sync_hash and device_hashes.get(user_id) == sync_hash:
+                        results.append({
+                            "success": True,
+                            "user_id": user_id,
+                            "device": device_id,
+                            "message": "Unchanged, skipped"
+                        })
+                        continue
+                        
+                    if existing_user:
+                        uid = existing_user.uid
+                    else:
+                        uid = next_uid
+                        next_uid += 1
+                        
+                    result, user_templates = self.sync_user_on_connection(conn, user_data, uid, existing_users, device_id)
+                    results.append(result)
+                    if user_templates:
+                        pending_templates.append((result, user_templates))
+                        
+                    if len(pending_templates) >= TEMPLATE_BATCH_SIZE:
+                        use_bulk = self.save_templates_batch(conn, pending_templates, use_bulk)
+                        pending_templates = []
+                        
+                if pending_templates:
+                    use_bulk = self.save_templates_batch(conn, pending_templates, use_bulk)
+                    
+            # Remember what this device now holds; failed users are retried next run
+            for user_data, result in zip(users_data, results):
+                if result["success"] and user_data.get('sync_hash'):
+                    device_hashes[user_data['user_id']] = user_data['sync_hash']
+                else:
+                    device_hashes.pop(user_data['user_id'], None)
+            self.sync_hashes[device_id] = device_hashes
             
-            # Delete existing user if exists
-            existing_users = conn.get_users()
-            user_exists = any(u.user_id == user_id for u in existing_users)
+            return True, results
+                
+        except DeviceConnectionError as e:
+            return failed_all(str(e))
+        except Exception as e:
+            return failed_all(f"Error: {str(e)}")
             
-            if user_exists:
-                conn.delete_user(user_id=user_id)
-                time.sleep(0.1)
+    def sync_user_on_connection(self, conn, user_data, uid, existing_users, device_id):
+        """Create single user on an open target connection
+
+        existing_users ({user_id: User}) is updated in place. Templates are
+        not sent here; the caller saves them in batches.
+
+        Returns:
+            tuple: (result dict, [User, [Finger, ...]] or None on error)
+        """
+        user_id = user_data['user_id']
+        
+        try:
+            # Delete existing user if exists (delete_user waits for the device ACK).
+            # Pass the uid: without it pyzk reads the whole user table to look it up
+            existing_user = existing_users.pop(user_id, None)
+            if existing_user:
+                conn.delete_user(uid=existing_user.uid, user_id=user_id)
                 
             # Create user
-            shortened_name = self.shorten_name(user_data['name'], 24)
+            shortened_name = user_data.get('shortened_name') or self.shorten_name(user_data['name'], 24)
+            password = user_data.get('password') or ''
+            group_id = user_data.get('group_id', '')
             
-            if user_data.get('password'):
-                conn.set_user(
-                    name=shortened_name,
-                    privilege=user_data['privilege'],
-                    password=user_data['password'],
-                    group_id=user_data.get('group_id', ''),
-                    user_id=user_id
-                )
-            else:
-                conn.set_user(
-                    name=shortened_name,
-                    privilege=user_data['privilege'],
-                    group_id=user_data.get('group_id', ''),
-                    user_id=user_id
-                )
-                
-            # Verify user creation
-            users = conn.get_users()
-            created_user = next((u for u in users if u.user_id == user_id), None)
+            conn.set_user(
+                uid=uid,
+                name=shortened_name,
+                privilege=user_data['privilege'],
+                password=password,
+                group_id=group_id,
+                user_id=user_id
+            )
             
-            if not created_user:
-                return {
-                    "success": False,
-                    "user_id": user_id,
-                    "device": device_id,
-                    "message": f"Failed to create user {user_id}"
-                }
+            # set_user raises on failure, so record the new user locally
+            # instead of re-reading the whole user table
+            created_user = User(uid, shortened_name, user_data['privilege'], password, group_id, user_id)
+            existing_users[user_id] = created_user
                 
-            # Prepare fingerprint templates
-            decoded_templates = {}
-            for fp in user_data['fingerprints']:
-                try:
-                    finger_index = fp['finger_index']
-                    decoded_templates[finger_index] = base64.b64decode(fp['template_data'])
-                except Exception:
-                    pass
-                    
-            # Create 10 Finger objects
-            templates_to_send = []
-            fingerprint_count = 0
-            
-            for i in range(10):
-                if i in decoded_templates:
-                    finger_obj = Finger(uid=created_user.uid, fid=i, valid=True, template=decoded_templates[i])
-                    fingerprint_count += 1
-                else:
-                    finger_obj = Finger(uid=created_user.uid, fid=i, valid=False, template=b'')
-                templates_to_send.append(finger_obj)
+            # Finger objects, shared by all target devices
+            templates_to_send = user_data.get('fingers') or self.build_fingers(user_data)
+            fingerprint_count = 10 - user_data['templates'].count(None)
                 
-            # Send templates to device
-            conn.save_user_template(created_user, templates_to_send)
-            
-            conn.enable_device()
-            conn.disconnect()
-            
             return {
                 "success": True,
                 "user_id": user_id,
                 "device": device_id,
                 "message": f"Synced {fingerprint_count} fingerprints"
-            }
+            }, [created_user, templates_to_send]
             
         except Exception as e:
             return {
@@ -227,46 +416,120 @@ class MasterToTargetSync:
                 "user_id": user_id,
                 "device": device_id,
                 "message": f"Error: {str(e)}"
-            }
+            }, None
             
-    def sync_user_to_all_targets(self, user_data):
-        """Sync single user to all target devices using threading"""
-        user_id = user_data['user_id']
+    def build_fingers(self, user_data):
+        """Build Finger objects for a user's enrolled fingers
+
+        The device-side uid is taken from the User sent alongside the
+        fingers, so the same list can be reused for every target device.
+        Blank fingers are not built: the user is deleted and re-created on
+        the target before its templates are sent, so there is nothing to clear.
+        """
+        return [
+            Finger(uid=user_data['uid'], fid=i, valid=True, template=template)
+            for i, template in enumerate(user_data['templates'])
+            if template is not None
+        ]
+        
+    def save_templates_batch(self, conn, pending_templates, use_bulk):
+        """Send templates for several users
+
+        pending_templates is a list of (result, [User, [Finger, ...]]). Uses
+        one HR_save_usertemplates request when use_bulk is set, otherwise (or
+        if the bulk request fails) one save_user_template per user; only the
+        users whose own save failed are marked failed.
+
+        Returns:
+            bool: whether to keep using the bulk request on this connection
+        """
+        if use_bulk:
+            try:
+                conn.HR_save_usertemplates([user_templates for _, user_templates in pending_templates])
+                return True
+            except Exception as e:
+                self.logger.warning(f"Bulk template upload failed ({str(e)}), saving per user on this connection")
+                use_bulk = False
+        
+        for result, (user, fingers) in pending_templates:
+            try:
+                conn.save_user_template(user, fingers)
+            except Exception as e:
+                result["success"] = False
+                result["message"] = f"Error saving templates: {str(e)}"
+        return use_bulk
+            
+    def sync_user_to_device(self, user_data, target_device):
+        """Sync single user to single target device"""
+        return self.sync_device(target_device, [user_data])[1][0]
+        
+    def sync_all_to_targets(self, users_data):
+        """Sync all users to all target devices, one worker per device
+
+        A target counts as successful when its session completed; users that
+        failed on it are counted separately in failed_user_syncs.
+
+        Returns:
+            dict: success, successful_targets, total_targets, failed_user_syncs,
+                  message and results_by_user ({user_id: [result, ...]})
+        """
+        results_by_user = {user_data['user_id']: [] for user_data in users_data}
+        successful_targets = 0
+        failed_user_syncs = 0
         
-        results = []
-        success_count = 0
+        # Build each user's Finger list and content hash once before fanning out to devices
+        for user_data in users_data:
+            user_data['fingers'] = self.build_fingers(user_data)
+            user_data['sync_hash'] = self.compute_sync_hash(user_data)
         
-        # Use ThreadPoolExecutor for concurrent sync
-        with ThreadPoolExecutor(max_workers=min(len(self.target_devices), 5)) as executor:
+        if not self.target_devices:
+            return {
+                "success": False,
+                "successful_targets": 0,
+                "total_targets": 0,
+                "failed_user_syncs": 0,
+                "message": "No target devices configured",
+                "results_by_user": results_by_user
+            }
+            
+        # One executor for the whole run, one worker per target device up to the global cap
+        with ThreadPoolExecutor(max_workers=min(len(self.target_devices), MAX_DEVICE_WORKERS), thread_name_prefix="dev-sync") as executor:
             future_to_device = {
-                executor.submit(self.sync_user_to_device, user_data, device): device
+                executor.submit(self.sync_device, device, users_data): device
                 for device in self.target_devices
             }
             
             for future in as_completed(future_to_device):
                 device = future_to_device[future]
                 try:
-                    result = future.result()
-                    results.append(result)
-                    
-                    if result["success"]:
-                        success_count += 1
-                        
+                    completed, device_results = future.result()
                 except Exception as e:
-                    error_result = {
+                    completed, device_results = False, [{
                         "success": False,
-                        "user_id": user_id,
+                        "user_id": user_data['user_id'],
                         "device": device['device_id'],
                         "message": f"Exception: {str(e)}"
-                    }
-                    results.append(error_result)
+                    } for user_data in users_data]
+                    
+                for result in device_results:
+                    results_by_user[result['user_id']].append(result)
                     
+                if completed:
+                    successful_targets += 1
+                    failed_users = sum(1 for result in device_results if not result["success"])
+                    failed_user_syncs += failed_users
+                    if failed_users:
+                        self.logger.warning(f"⚠️ {device['device_id']}: {failed_users}/{len(device_results)} users failed")
+                    
+        self.save_sync_hashes()
+        
         return {
-            "user_id": user_id,
-            "name": user_data['name'],
-            "total_devices": len(self.target_devices),
-            "success_count": success_count,
-            "results": results
+            "success": successful_targets > 0,
+            "successful_targets": successful_targets,
+            "total_targets": len(self.target_devices),
+            "failed_user_syncs": failed_user_syncs,
+            "message": "" if successful_targets > 0 else "No target device synced successfully",
+            "results_by_user": results_by_user
         }
         
     def sync_all_users(self):
@@ -282,38 +545,37 @@ class MasterToTargetSync:
             self.logger.error("❌ No users with fingerprints found on master device")
             return False
             
-        # Sync each user to all target devices
+        # Sync all users to each target device
         total_users = len(users_data)
         processed_users = 0
         successful_users = 0
         
         self.logger.info(f"📤 Syncing {total_users} users to {len(self.target_devices)} target devices...")
         
+        sync_result = self.sync_all_to_targets(users_data)
+        results_by_user = sync_result["results_by_user"]
+        
         for i, user_data in enumerate(users_data, 1):
             user_id = user_data['user_id']
             user_name = user_data['name']
             
             self.logger.info(f"Progress: {i}/{total_users} - {user_id}: {user_name}")
             
-            try:
-                result = self.sync_user_to_all_targets(user_data)
-                processed_users += 1
+            user_results = results_by_user.get(user_id, [])
+            processed_users += 1
+            
+            success_devices = [r["device"] for r in user_results if r["success"]]
+            if success_devices:
+                successful_users += 1
+                # Show successful devices
+                self.logger.info(f"  ✅ Synced to {len(success_devices)}/{len(self.target_devices)} devices: {', '.join(success_devices)}")
+            else:
+                self.logger.error(f"  ❌ Failed to sync to any devices")
                 
-                if result["success_count"] > 0:
-                    successful_users += 1
-                    # Show successful devices
-                    success_devices = [r["device"] for r in result["results"] if r["success"]]
-                    self.logger.info(f"  ✅ Synced to {result['success_count']}/{result['total_devices']} devices: {', '.join(success_devices)}")
-                else:
-                    self.logger.error(f"  ❌ Failed to sync to any devices")
-                    
-                # Show details for failed devices
-                for device_result in result["results"]:
-                    if not device_result["success"]:
-                        self.logger.error(f"    {device_result['device']}: {device_result['message']}")
-                        
-            except Exception as e:
-                self.logger.error(f"Error processing user {user_id}: {str(e)}")
+            # Show details for failed devices
+            for device_result in user_results:
+                if not device_result["success"]:
+                    self.logger.error(f"    {device_result['device']}: {device_result['message']}")
                 
         # Final summary
         self.logger.info("=" * 60)
@@ -346,25 +608,27 @@ def main():
     args = parser.parse_args()
     
     sync_manager = MasterToTargetSync()
+    try:
+        # Get users first to show count
+        users = sync_manager.get_all_users_with_fingerprints()
     
-    # Get users first to show count
-    users = sync_manager.get_all_users_with_fingerprints()
-    
-    if not users:
-        print("❌ No users with fingerprints found")
-        return 1
+        if not users:
+            print("❌ No users with fingerprints found")
+            return 1
         
-    if args.limit:
-        users = users[:args.limit]
-        print(f"🔢 Limited to {len(users)} users for testing")
+        if args.limit:
+            users = users[:args.limit]
+            print(f"🔢 Limited to {len(users)} users for testing")
         
-    # Temporarily modify the sync manager's data
-    original_method = sync_manager.get_all_users_with_fingerprints
-    sync_manager.get_all_users_with_fingerprints = lambda: users
+        # Temporarily modify the sync manager's data
+        original_method = sync_manager.get_all_users_with_fingerprints
+        sync_manager.get_all_users_with_fingerprints = lambda: users
     
-    success = sync_manager.sync_all_users()
+        success = sync_manager.sync_all_users()
     
-    return 0 if success else 1
+        return 0 if success else 1
+    finally:
+        sync_manager.close_logging()
 
 if __name__ == "__main__":
     exit(main())
\ No newline at end of file
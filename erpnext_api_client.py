@@ -12,8 +12,13 @@ class ERPNextAPIClient:
     ERPNext REST API Client for standalone operation
     """
     
-    def __init__(self, base_url, api_key, api_secret):
+    # Max employee names per bulk fingerprint request (keeps the GET query string short)
+    FINGERPRINT_BULK_CHUNK = 100
+    
+    def __init__(self, base_url, api_key, api_secret, bulk_fingerprints=True):
         self.base_url = base_url.rstrip('/')
+        # Fetch fingerprint rows for many employees per request; False = one Employee request each
+        self.bulk_fingerprints = bulk_fingerprints
         self.api_key = api_key
         self.api_secret = api_secret
         self.session = requests.Session()
@@ -53,11 +58,11 @@ class ERPNextAPIClient:
     
 
     def get_employees_with_fingerprints(self):
-        """Get all active employees with fingerprint data - individual calls only"""
+        """Get all active employees with fingerprint data - bulk fingerprint query, per-employee fallback"""
         try:
             logger.info("Fetching employees with fingerprint data from ERPNext API...")
             
-            # Get employees first, then individual fingerprint calls
+            # Get employees first, then their fingerprints (bulk, or one call per employee)
             endpoint = '/api/resource/Employee'
             params = {
                 'filters': json.dumps({"status": "Active"}),
@@ -69,14 +74,20 @@ class ERPNextAPIClient:
             response = self._make_request('GET', endpoint, params=params)
             employees = response.get('data', [])
             
+            # All fingerprint rows in one request; None = fall back to per-employee calls
+            bulk_fingerprints = self.get_bulk_fingerprint_data() if self.bulk_fingerprints else None
+            
             employees_with_fingerprints = []
             
             for emp in employees:
                 if not emp.get('attendance_device_id'):
                     continue
                 
-                # Get fingerprints using individual Employee document call
-                fingerprints = self.get_fingerprint_data(emp['name'])
+                if bulk_fingerprints is not None:
+                    fingerprints = bulk_fingerprints.get(emp['name'], [])
+                else:
+                    # Get fingerprints using individual Employee document call
+                    fingerprints = self.get_fingerprint_data(emp['name'])
                 
                 if fingerprints:
                     privilege_str = emp.get('custom_privilege', 'USER_DEFAULT')
@@ -134,6 +145,59 @@ class ERPNextAPIClient:
             logger.error(f"Error getting fingerprint data for employee {employee_id}: {str(e)}")
             return []
     
+    def get_bulk_fingerprint_data(self, employee_ids=None):
+        """Get fingerprint data for many employees with frappe.client.get_list on the child table
+
+        Args:
+            employee_ids: Employee names to fetch; None = all employees (one request)
+
+        Returns:
+            dict: {employee_id: [fingerprint, ...]} in the same format as get_fingerprint_data,
+                  or None if the bulk query failed (callers fall back to per-employee calls).
+                  After a failure bulk_fingerprints is switched off for this client, so
+                  servers that reject child-table access (403) are only asked once.
+        """
+        try:
+            endpoint = '/api/method/frappe.client.get_list'
+            if employee_ids is None:
+                parent_chunks = [None]
+            else:
+                employee_ids = list(employee_ids)
+                parent_chunks = [employee_ids[i:i + self.FINGERPRINT_BULK_CHUNK]
+                                 for i in range(0, len(employee_ids), self.FINGERPRINT_BULK_CHUNK)]
+            
+            fingerprints_by_employee = {}
+            for parents in parent_chunks:
+                filters = {"parenttype": "Employee", "parentfield": "custom_fingerprints"}
+                if parents is not None:
+                    filters["parent"] = ["in", parents]
+                params = {
+                    'doctype': 'Fingerprint Data',
+                    'parent': 'Employee',
+                    'filters': json.dumps(filters),
+                    'fields': json.dumps(["parent", "finger_index", "template_data", "quality_score", "finger_name"]),
+                    'order_by': 'parent asc, idx asc',
+                    'limit_page_length': 0
+                }
+                
+                response = self._make_request('GET', endpoint, params=params)
+                for fp in response.get('message', []):
+                    if fp.get('template_data'):
+                        fingerprints_by_employee.setdefault(fp['parent'], []).append({
+                            'finger_index': fp.get('finger_index'),
+                            'template_data': fp.get('template_data'),
+                            'quality_score': fp.get('quality_score', 0),
+                            'finger_name': fp.get('finger_name', '')
+                        })
+            
+            logger.info(f"Fetched fingerprint data for {len(fingerprints_by_employee)} employees in bulk")
+            return fingerprints_by_employee
+            
+        except Exception as e:
+            logger.warning(f"Bulk fingerprint fetch failed, using per-employee calls from now on: {str(e)}")
+            self.bulk_fingerprints = False
+            return None
+    
     def get_changed_employees_with_fingerprints(self, since_datetime):
         """Get employees with fingerprint data modified since datetime - with fallback"""
         try:
@@ -166,13 +230,22 @@ class ERPNextAPIClient:
             response = self._make_request('GET', endpoint, params=params)
             employees = response.get('data', [])
             
+            # Fingerprint rows for the changed employees in bulk; None = fall back to per-employee calls
+            bulk_fingerprints = None
+            if self.bulk_fingerprints:
+                changed_ids = [emp['name'] for emp in employees if emp.get('attendance_device_id')]
+                bulk_fingerprints = self.get_bulk_fingerprint_data(changed_ids) if changed_ids else {}
+            
             employees_with_fingerprints = []
             
             for emp in employees:
                 if not emp.get('attendance_device_id'):
                     continue
                 
-                fingerprints = self.get_fingerprint_data(emp['name'])
+                if bulk_fingerprints is not None:
+                    fingerprints = bulk_fingerprints.get(emp['name'], [])
+                else:
+                    fingerprints = self.get_fingerprint_data(emp['name'])
                 
                 # FIXED: Include employee even if fingerprints is empty (deleted case)
                 privilege_str = emp.get('custom_privilege', 'USER_DEFAULT')
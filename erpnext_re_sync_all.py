@@ -21,9 +21,14 @@ Usage:
 
 import os
 import sys
+import time
 import datetime
 import argparse
+import atexit
+import logging
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 # Add current directory to path for local imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -31,6 +36,7 @@ sys.path.append(current_dir)
 
 # Load shared configuration
 import local_config
+from zk import ZK
 from manual_input_utils import prompt_date_range, prompt_single_date, prompt_integer
 
 # =============================================================================
@@ -41,18 +47,22 @@ TIME_SYNC_LOG_FILE = 'logs/time_sync.log'
 TIME_SYNC_MAX_DIFF_SECONDS = 2
 TIME_SYNC_TIMEOUT_SECONDS = 3
 
+# Create log directories once instead of on every log call
+for _log_file in (END_OF_DAY_RESYNC_LOG_FILE, TIME_SYNC_LOG_FILE):
+    os.makedirs(os.path.dirname(_log_file), exist_ok=True)
+
 def get_end_of_day_resync_date_range():
     """Get date range for end-of-day re-sync (today only)"""
     today = datetime.datetime.now().strftime('%Y%m%d')
     return [today, today]
 
-def setup_resync_logger():
-    """Setup dedicated logger for end-of-day re-sync operations"""
-    import logging
-    import os
+_RESYNC_LOGGER = None
 
-    # Create logs directory if it doesn't exist
-    os.makedirs('logs', exist_ok=True)
+def setup_resync_logger():
+    """Setup dedicated logger for end-of-day re-sync operations (configured once)"""
+    global _RESYNC_LOGGER
+    if _RESYNC_LOGGER is not None:
+        return _RESYNC_LOGGER
 
     # Create dedicated logger for re-sync
     logger = logging.getLogger('resync_logger')
@@ -76,6 +86,7 @@ def setup_resync_logger():
     # Prevent propagation to root logger to avoid duplicate entries
     logger.propagate = False
 
+    _RESYNC_LOGGER = logger
     return logger
 
 def log_resync_operation(message, level='INFO'):
@@ -91,6 +102,18 @@ def log_resync_operation(message, level='INFO'):
     except Exception as e:
         print(f"Failed to log re-sync operation: {e}")
 
+_TIME_SYNC_LOG_FH = None
+_TIME_SYNC_LOG_LOCK = threading.Lock()  # time sync writes from one thread per device
+_TIME_SYNC_LOG_TS = (None, "")  # (epoch second, formatted timestamp) of the last log line
+
+def _get_time_sync_log_file():
+    """Open the time sync log once and keep it open for later writes"""
+    global _TIME_SYNC_LOG_FH
+    if _TIME_SYNC_LOG_FH is None:
+        _TIME_SYNC_LOG_FH = open(TIME_SYNC_LOG_FILE, 'a', encoding='utf-8')
+        atexit.register(_TIME_SYNC_LOG_FH.close)
+    return _TIME_SYNC_LOG_FH
+
 def log_time_sync_operation(message, level="INFO"):
     """Log time sync operations to dedicated log file
 
@@ -98,77 +121,88 @@ def log_time_sync_operation(message, level="INFO"):
         message (str): Log message
         level (str): Log level (INFO, WARNING, ERROR)
     """
-    import os
-
-    # Ensure logs directory exists
-    log_dir = os.path.dirname(TIME_SYNC_LOG_FILE)
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
-
-    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    global _TIME_SYNC_LOG_TS
+    now = time.time()
+    second = int(now)
+    cached_second, timestamp = _TIME_SYNC_LOG_TS
+    if second != cached_second:
+        # Several lines are usually logged within the same second
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+        _TIME_SYNC_LOG_TS = (second, timestamp)
     log_entry = f"[{timestamp}] [{level}] {message}\n"
 
     try:
-        with open(TIME_SYNC_LOG_FILE, 'a', encoding='utf-8') as f:
+        with _TIME_SYNC_LOG_LOCK:
+            f = _get_time_sync_log_file()
             f.write(log_entry)
+            f.flush()
     except Exception as e:
         print(f"Failed to write time sync log: {e}")
 
-def sync_time_to_devices(devices_list=None, force=False):
-    """Synchronize time from server to biometric devices (without restart)
+# device_id -> (next_attempt_timestamp, consecutive_failures) for unreachable devices
+_DEVICE_BACKOFF = {}
+DEVICE_BACKOFF_MAX_SECONDS = 300
+
+def _record_device_failure(device_id):
+    """Back off from an unreachable device: 10s, 20s, 40s ... capped at DEVICE_BACKOFF_MAX_SECONDS"""
+    failures = _DEVICE_BACKOFF.get(device_id, (0, 0))[1] + 1
+    _DEVICE_BACKOFF[device_id] = (time.time() + min(DEVICE_BACKOFF_MAX_SECONDS, 5 * 2 ** failures), failures)
+
+def _sync_time_to_device(device, server_time, force=False, restart=False):
+    """Synchronize time to a single device
 
     Args:
-        devices_list (list): List of devices to sync time to. If None, uses all devices.
+        device (dict): Device config (device_id, ip)
+        server_time (datetime): Time to compare against and set on the device
         force (bool): Force sync even if time difference is small
+        restart (bool): Restart the device on the same connection after the time check
 
     Returns:
-        dict: Summary of sync results
+        dict: Per-device result, with "status" set to 'success', 'skipped' or 'failed'
     """
-    from zk import ZK
-    import datetime
-
-    if devices_list is None:
-        devices_list = local_config.devices
-
-    server_time = datetime.datetime.now()
-    results = {
-        "total_devices": len(devices_list),
-        "success_count": 0,
-        "failed_count": 0,
-        "skipped_count": 0,
-        "details": []
+    device_id = device['device_id']
+    device_ip = device['ip']
+    device_result = {
+        "device_id": device_id,
+        "device_ip": device_ip,
+        "success": False,
+        "message": "",
+        "time_diff_seconds": None,
+        "old_time": None,
+        "new_time": None,
+        "restarted": False,
+        "status": "failed"
     }
 
-    log_time_sync_operation(f"Starting time sync to {len(devices_list)} devices (Sunday 23:00)")
-    log_time_sync_operation(f"Server time: {server_time}")
+    # Skip devices that were unreachable recently (force always retries)
+    next_attempt = _DEVICE_BACKOFF.get(device_id, (0, 0))[0]
+    if not force and time.time() < next_attempt:
+        device_result["message"] = f"Device unreachable recently, retry in {next_attempt - time.time():.0f}s"
+        log_time_sync_operation(f"Skipping {device_id} - in backoff after connection failure", "WARNING")
+        return device_result
 
-    for device in devices_list:
-        device_id = device['device_id']
-        device_ip = device['ip']
-        device_result = {
-            "device_id": device_id,
-            "device_ip": device_ip,
-            "success": False,
-            "message": "",
-            "time_diff_seconds": None,
-            "old_time": None,
-            "new_time": None
-        }
+    message_parts = []
+    try:
+        log_time_sync_operation(f"Connecting to device {device_id} ({device_ip})")
 
+        # Connect to device
+        zk = ZK(device_ip, port=4370, timeout=TIME_SYNC_TIMEOUT_SECONDS, force_udp=True)
         try:
-            log_time_sync_operation(f"Connecting to device {device_id} ({device_ip})")
-
-            # Connect to device
-            zk = ZK(device_ip, port=4370, timeout=TIME_SYNC_TIMEOUT_SECONDS, force_udp=True)
             conn = zk.connect()
+        except Exception:
+            # Only connection failures put a device in backoff
+            _record_device_failure(device_id)
+            raise
 
-            if not conn:
-                device_result["message"] = "Failed to connect to device"
-                results["failed_count"] += 1
-                log_time_sync_operation(f"Failed to connect to {device_id}", "ERROR")
-                results["details"].append(device_result)
-                continue
+        if not conn:
+            _record_device_failure(device_id)
+            device_result["message"] = "Failed to connect to device"
+            log_time_sync_operation(f"Failed to connect to {device_id}", "ERROR")
+            return device_result
 
+        _DEVICE_BACKOFF.pop(device_id, None)
+
+        try:
             # Get current device time
             device_time = conn.get_time()
             device_result["old_time"] = device_time
@@ -181,32 +215,90 @@ def sync_time_to_devices(devices_list=None, force=False):
 
             # Check if sync is needed
             if not force and time_diff < TIME_SYNC_MAX_DIFF_SECONDS:
-                device_result["message"] = f"Time difference ({time_diff:.1f}s) within tolerance"
+                message_parts.append(f"Time difference ({time_diff:.1f}s) within tolerance")
                 device_result["success"] = True
-                results["skipped_count"] += 1
+                device_result["status"] = "skipped"
                 log_time_sync_operation(f"Skipping {device_id} - time difference within tolerance")
             else:
                 # Sync time to device (without restart)
                 conn.set_time(server_time)
                 device_result["new_time"] = server_time
                 device_result["success"] = True
-                device_result["message"] = f"Time synced successfully (diff: {time_diff:.1f}s)"
-                results["success_count"] += 1
+                device_result["status"] = "success"
+                message_parts.append(f"Time synced successfully (diff: {time_diff:.1f}s)")
                 log_time_sync_operation(f"Time synced to {device_id} successfully")
+        finally:
+            # A failed time read/write must not cancel the requested restart
+            if restart:
+                # Restart on the live connection; the device drops the link itself
+                try:
+                    conn.restart()
+                    device_result["restarted"] = True
+                    message_parts.append(" and device restarted")
+                    log_time_sync_operation(f"Device {device_id} restart command sent successfully")
+                except Exception as restart_error:
+                    message_parts.append(f" (restart failed: {restart_error})")
+                    log_time_sync_operation(f"Error restarting device {device_id}: {restart_error}", "ERROR")
+
+            # Disconnect from device, on every path unless it is restarting
+            if not device_result["restarted"]:
+                try:
+                    conn.disconnect()
+                    log_time_sync_operation(f"Disconnected from {device_id}")
+                except Exception as disc_error:
+                    log_time_sync_operation(f"Warning: Failed to disconnect from {device_id}: {disc_error}", "WARNING")
 
-            # Disconnect from device
-            try:
-                conn.disconnect()
-                log_time_sync_operation(f"Disconnected from {device_id}")
-            except Exception as disc_error:
-                log_time_sync_operation(f"Warning: Failed to disconnect from {device_id}: {disc_error}", "WARNING")
+        device_result["message"] = "".join(message_parts)
 
-        except Exception as e:
-            device_result["message"] = f"Error: {str(e)}"
-            results["failed_count"] += 1
-            log_time_sync_operation(f"Error syncing time to {device_id}: {e}", "ERROR")
+    except Exception as e:
+        device_result["success"] = False
+        device_result["status"] = "failed"
+        device_result["message"] = f"Error: {str(e)}" + "".join(message_parts)
+        log_time_sync_operation(f"Error syncing time to {device_id}: {e}", "ERROR")
 
-        results["details"].append(device_result)
+    return device_result
+
+def sync_time_to_devices(devices_list=None, force=False, restart=False):
+    """Synchronize time from server to biometric devices (optionally restart them)
+
+    Devices are processed in parallel, so an unreachable device only costs
+    one connection timeout instead of delaying every device after it.
+
+    Args:
+        devices_list (list): List of devices to sync time to. If None, uses all devices.
+        force (bool): Force sync even if time difference is small
+        restart (bool): Restart each device on the time sync connection
+
+    Returns:
+        dict: Summary of sync results
+    """
+    if devices_list is None:
+        devices_list = local_config.devices
+
+    server_time = datetime.datetime.now()
+    results = {
+        "total_devices": len(devices_list),
+        "success_count": 0,
+        "failed_count": 0,
+        "skipped_count": 0,
+        "restarted_count": 0,
+        "details": []
+    }
+
+    log_time_sync_operation(f"Starting time sync to {len(devices_list)} devices (Sunday 23:00)")
+    log_time_sync_operation(f"Server time: {server_time}")
+
+    if devices_list:
+        with ThreadPoolExecutor(max_workers=min(len(devices_list), 10), thread_name_prefix="time-sync") as executor:
+            futures = [executor.submit(_sync_time_to_device, device, server_time, force, restart)
+                       for device in devices_list]
+            # Collect in config order so the summary lists devices predictably
+            for future in futures:
+                device_result = future.result()
+                results[f"{device_result.pop('status')}_count"] += 1
+                if device_result["restarted"]:
+                    results["restarted_count"] += 1
+                results["details"].append(device_result)
 
     # Log summary
     log_time_sync_operation(f"Time sync completed - Success: {results['success_count']}, Failed: {results['failed_count']}, Skipped: {results['skipped_count']}")
@@ -222,8 +314,6 @@ def restart_all_devices(devices_list=None):
     Returns:
         dict: Summary of restart results
     """
-    from zk import ZK
-
     if devices_list is None:
         devices_list = local_config.devices
 
@@ -382,13 +472,14 @@ class ManualResyncTool:
             self.log_section_end("END-OF-DAY RESYNC", False)
             return False
 
-    def execute_time_sync_to_devices(self, force=False):
+    def execute_time_sync_to_devices(self, force=False, restart=False):
         """Execute time synchronization to all devices
 
         MOVED from erpnext_sync_all.py - now manual execution only
 
         Args:
             force: Force sync even if time difference is small
+            restart: Restart each device on the time sync connection
 
         Returns:
             dict: Sync results
@@ -401,13 +492,15 @@ class ManualResyncTool:
             self.log_operation(f"Connection timeout: {TIME_SYNC_TIMEOUT_SECONDS}s")
 
             # Execute time sync
-            results = sync_time_to_devices(force=force)
+            results = sync_time_to_devices(force=force, restart=restart)
 
             # Log results
             self.log_operation(f"Total devices: {results['total_devices']}")
             self.log_operation(f"Successful: {results['success_count']}")
             self.log_operation(f"Failed: {results['failed_count']}")
             self.log_operation(f"Skipped: {results['skipped_count']}")
+            if restart:
+                self.log_operation(f"Restarted: {results['restarted_count']}")
 
             # Log individual device results
             for detail in results.get('details', []):
@@ -472,17 +565,13 @@ class ManualResyncTool:
         self.log_section_start("TIME SYNC AND RESTART")
 
         try:
-            # Execute time sync first
-            self.log_operation("Step 1: Syncing time to devices...")
-            sync_results = self.execute_time_sync_to_devices(force=force)
-
-            # Execute restart
-            self.log_operation("Step 2: Restarting all devices...")
-            restart_results = self.execute_restart_all_devices()
+            # Sync time and restart each device on the same connection
+            self.log_operation("Syncing time and restarting devices...")
+            sync_results = self.execute_time_sync_to_devices(force=force, restart=True)
 
             # Summary
-            sync_ok = sync_results.get('failed_count', 0) == 0
-            restart_ok = restart_results.get('failed_count', 0) == 0
+            sync_ok = 'failed_count' in sync_results and sync_results['failed_count'] == 0
+            restart_ok = sync_results.get('restarted_count', 0) == sync_results.get('total_devices', 0)
             overall_success = sync_ok and restart_ok
 
             self.log_operation(f"Time sync: {'OK' if sync_ok else 'FAILED'}")
@@ -919,6 +1008,7 @@ class ManualResyncTool:
         """
         self.log_section_start("SYNC ALL FROM MASTER TO OTHER DEVICES")
 
+        sync_manager = None
         try:
             import importlib.util
             spec = importlib.util.spec_from_file_location("sync_all_from_master",
@@ -963,6 +1053,8 @@ class ManualResyncTool:
             # Show results
             if result['success']:
                 self.log_operation(f"Sync completed: {result['successful_targets']}/{len(local_config.devices)} devices")
+                if result.get('failed_user_syncs'):
+                    self.log_operation(f"{result['failed_user_syncs']} user syncs failed on completed devices, see the log above", "WARNING")
                 self.log_section_end("SYNC ALL FROM MASTER TO OTHER DEVICES", True)
                 return True
             else:
@@ -975,6 +1067,9 @@ class ManualResyncTool:
             traceback.print_exc()
             self.log_section_end("SYNC ALL FROM MASTER TO OTHER DEVICES", False)
             return False
+        finally:
+            if sync_manager is not None:
+                sync_manager.close_logging()
 
     def execute_clean_user_on_machine(self):
         """Execute clean user on machine
@@ -1348,6 +1443,8 @@ Examples:
         print(f"Manual Resync Data Tool v1.0.0")
         return
 
+    local_config.print_startup_banner()
+
     # Initialize tool
     tool = ManualResyncTool()
 
@@ -33,6 +33,7 @@ class ERPNextSyncService:
         self.error_count = 0
         self.last_error = None
         self.running = True
+        self.clean_logs_done_date = None  # Date the daily log cleanup is known to be done
         
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGTERM, self.signal_handler)
@@ -42,6 +43,7 @@ class ERPNextSyncService:
     
     def log_startup(self):
         """Log service startup information"""
+        local_config.print_startup_banner()
         print(f"[{self.start_time}] Service started v{self.version}, freq={local_config.PULL_FREQUENCY}min")
     
     def signal_handler(self, signum, _frame):
@@ -171,13 +173,24 @@ class ERPNextSyncService:
 
     def should_run_clean_logs(self):
         """Check if should run log cleanup (once per day)"""
+        if getattr(local_config, 'CLEAN_OLD_LOGS_DAYS', 0) == 0:
+            return False
+
+        # Already done today: skip loading the cleanup module every cycle
+        today = datetime.date.today()
+        if self.clean_logs_done_date == today:
+            return False
+
         try:
             import importlib.util
             spec = importlib.util.spec_from_file_location("clean_old_logs",
                 os.path.join(os.path.dirname(os.path.abspath(__file__)), "03.clean_old_logs.py"))
             clean_old_logs = importlib.util.module_from_spec(spec)
             spec.loader.exec_module(clean_old_logs)
-            return clean_old_logs.should_run_cleanup()
+            should_run = clean_old_logs.should_run_cleanup()
+            if not should_run:
+                self.clean_logs_done_date = today
+            return should_run
         except Exception as e:
             print(f"Error checking clean logs status: {e}")
             return False
@@ -224,11 +237,13 @@ class ERPNextSyncService:
         print(f"[{cycle_start}] Cycle #{self.cycle_count}")
 
         self.reload_dynamic_config()
-        local_config.log_bypass_status()
 
-        cycle_success = True
+        # Evaluate the bypass checks against a single timestamp
+        with local_config.cycle_tick():
+            local_config.log_bypass_status()
+            log_bypass, log_period = local_config.should_bypass_log_sync()
 
-        log_bypass, log_period = local_config.should_bypass_log_sync()
+        cycle_success = True
 
         if not log_bypass:
             local_config.log_operation_decision("Sync Log", True, "Active")
@@ -1,4 +1,8 @@
+import contextlib
 import datetime
+import itertools
+import sys
+import threading
 # ERPNext related configs
 
 ERPNEXT_VERSION = 15 
@@ -56,7 +60,7 @@ devices = [
 ]
 devices_master = {'device_id':'Machine_1','ip':'10.0.1.41', 'punch_direction': None, 'clear_from_device_on_fetch': False, 'latitude':0.0000,'longitude':0.0000}
 sync_from_master_device_to_erpnext_filters_id = []  # [] = sync all user IDs from master device
-user_id_inorged = ['55','58','161','623','916','920','3000','3001','3002','6004','6005','6006','6007','6008']  # Tạp vụ IDs to ignore
+user_id_inorged = frozenset({'55','58','161','623','916','920','3000','3001','3002','6004','6005','6006','6007','6008'})  # Tạp vụ IDs to ignore (set for O(1) lookup)
 # Feature toggles
 ENABLE_SYNC_USER_INFO_FROM_ERPNEXT_TO_DEVICE = False
 
@@ -78,6 +82,7 @@ LOG_BACKUP_COUNT = 3  # Keep only 5 backup files (reduced from 50 to save disk s
 
 SYNC_USER_INFO_MODE = 'auto'  # 'full', 'changed', 'auto'
 SYNC_CHANGED_HOURS_BACK = 24
+USE_TCP = True  # Connect to devices over TCP when syncing user info (falls back to UDP; set False for firmware < 6.60)
 
 # MongoDB sync feature toggle
 ENABLE_SYNC_LOG_FROM_MONGODB_TO_ERPNEXT = True
@@ -107,13 +112,17 @@ MONGODB_OT_COLLECTION = "OtRegister"  # Overtime registration collection
 # NOTE: MANUAL MODE ONLY configs (ENABLE_RESYNC_ON_DAY, ENABLE_TIME_SYNC_AND_RESTART, etc.)
 # have been moved to erpnext_re_sync_all.py
 
-print(f'\n------------------ START AT {datetime.datetime.now()} ------------------')
-print(f'- ERPNext URL: {ERPNEXT_URL}')
-print(f'- ERPNext API : Key: {ERPNEXT_API_KEY}  | Secret: {ERPNEXT_API_SECRET}') 
-print(f'- Devices: {devices}')
-print(f'- Pull frequency: {PULL_FREQUENCY} minutes')
-print(f'- Logs directory: {LOGS_DIRECTORY}') 
-print('------------------------------------------------------------------')
+def print_startup_banner():
+    """Print configuration banner (called once by the entry point, not on import)"""
+    sys.stdout.write("\n".join([
+        f'\n------------------ START AT {datetime.datetime.now()} ------------------',
+        f'- ERPNext URL: {ERPNEXT_URL}',
+        f'- ERPNext API : Key: {ERPNEXT_API_KEY}  | Secret: {ERPNEXT_API_SECRET}',
+        f'- Devices: {devices}',
+        f'- Pull frequency: {PULL_FREQUENCY} minutes',
+        f'- Logs directory: {LOGS_DIRECTORY}',
+        '------------------------------------------------------------------',
+    ]) + "\n")
 
 # shift_type_device_mapping = [
 #     {
@@ -138,32 +147,69 @@ allowed_exceptions = [1,2,3]
 # DYNAMIC TIME-BASED BYPASS CONFIGURATIONS
 # =============================================================================
 
+# Per-thread "now" shared by the checks inside one cycle_tick() block
+_NOW_CACHE = threading.local()
+
+@contextlib.contextmanager
+def cycle_tick():
+    """Freeze get_current_datetime()/get_current_time() for the duration of the block
+
+    Nested blocks reuse the outer timestamp.
+    """
+    outer = getattr(_NOW_CACHE, 'now', None)
+    if outer is not None:
+        yield outer
+        return
+
+    _NOW_CACHE.now = datetime.datetime.now()
+    try:
+        yield _NOW_CACHE.now
+    finally:
+        _NOW_CACHE.now = None
+
 def get_current_time():
     """Get current time in HH:MM format"""
-    return datetime.datetime.now().strftime("%H:%M")
+    now = get_current_datetime()
+    return f"{now.hour:02d}:{now.minute:02d}"
 
 def get_current_datetime():
-    """Get current datetime"""
-    return datetime.datetime.now()
+    """Get current datetime (cached inside cycle_tick())"""
+    now = getattr(_NOW_CACHE, 'now', None)
+    return now if now is not None else datetime.datetime.now()
 
-def is_in_bypass_period(bypass_periods):
-    """Check if current time is in any bypass period"""
-    current_time = get_current_time()
-    current_dt = datetime.datetime.strptime(current_time, "%H:%M").time()
-    
+def _compile_bypass_periods(bypass_periods):
+    """Convert bypass periods to (start_minute, end_minute, crosses_midnight, period) tuples"""
+    compiled = []
     for period in bypass_periods:
         start_time = datetime.datetime.strptime(period["start"], "%H:%M").time()
         end_time = datetime.datetime.strptime(period["end"], "%H:%M").time()
-        
-        if start_time <= end_time:  # Same day
-            if start_time <= current_dt <= end_time:
-                return True, period
-        else:  # Cross midnight
-            if current_dt >= start_time or current_dt <= end_time:
-                return True, period
-    
+        start_min = start_time.hour * 60 + start_time.minute
+        end_min = end_time.hour * 60 + end_time.minute
+        compiled.append((start_min, end_min, start_min > end_min, period))
+    return tuple(compiled)
+
+def _match_bypass_period(compiled_periods):
+    """Check current minute of day against periods from _compile_bypass_periods()"""
+    if not compiled_periods:
+        return False, None
+
+    now = get_current_datetime()
+    now_min = now.hour * 60 + now.minute
+
+    for start_min, end_min, crosses_midnight, period in compiled_periods:
+        if crosses_midnight:
+            in_period = now_min >= start_min or now_min <= end_min
+        else:
+            in_period = start_min <= now_min <= end_min
+        if in_period:
+            return True, period
+
     return False, None
 
+def is_in_bypass_period(bypass_periods):
+    """Check if current time is in any bypass period"""
+    return _match_bypass_period(_compile_bypass_periods(bypass_periods))
+
 # Bypass periods for sync operations (during rush hours)
 sync_log_by_pass_period = []  # Format: [{"start": "07:30", "end": "07:55", "reason": "Morning rush"}]
 sync_user_info_by_pass_period = []  # Format: [{"start": "17:00", "end": "17:30", "reason": "Evening rush"}]
@@ -172,20 +218,45 @@ sync_user_info_by_pass_period = []  # Format: [{"start": "17:00", "end": "17:30"
 
 def should_bypass_log_sync():
     """Check if should bypass log sync to ERPNext"""
-    bypassed, period = is_in_bypass_period(sync_log_by_pass_period)
+    bypassed, period = _match_bypass_period(_SYNC_LOG_BYPASS_PERIODS)
     return bypassed, period
 
 def should_bypass_user_info_sync():
     """Check if should bypass user info/template sync to device"""
-    bypassed, period = is_in_bypass_period(sync_user_info_by_pass_period)
+    bypassed, period = _match_bypass_period(_SYNC_USER_INFO_BYPASS_PERIODS)
     return bypassed, period
 
-def get_bypass_status():
-    """Get current bypass status for all operations"""
-    log_bypass, log_period = should_bypass_log_sync()
-    user_bypass, user_period = should_bypass_user_info_sync()
+# Bypass status only changes at minute granularity ("HH:MM" periods)
+# Held as one (minute, status) tuple so readers never see a mismatched pair
+_bypass_cache = (None, None)
+
+# Template for the status when no bypass period is configured; callers get a copy
+_EMPTY_BYPASS_STATUS = {
+    'log_sync': {'bypassed': False, 'period': None, 'reason': None},
+    'user_sync': {'bypassed': False, 'period': None, 'reason': None}
+}
+
+def _copy_bypass_status(status):
+    """Copy of a shared status dict, so callers cannot change the cached one"""
+    return {op: dict(flags) for op, flags in status.items()}
 
-    return {
+def get_bypass_status():
+    """Get current bypass status for all operations (cached per minute)"""
+    global _bypass_cache
+    if not _ANY_BYPASS_CONFIGURED:
+        return _copy_bypass_status(_EMPTY_BYPASS_STATUS)
+
+    # Cache key and both checks share one clock read
+    with cycle_tick():
+        key = get_current_time()
+        cached_minute, cached_status = _bypass_cache
+        if key == cached_minute:
+            return _copy_bypass_status(cached_status)
+
+        log_bypass, log_period = should_bypass_log_sync()
+        user_bypass, user_period = should_bypass_user_info_sync()
+
+    status = {
         'log_sync': {
             'bypassed': log_bypass,
             'period': log_period,
@@ -197,53 +268,59 @@ def get_bypass_status():
             'reason': user_period.get('reason') if user_period else None
         }
     }
+    _bypass_cache = (key, status)
+    return _copy_bypass_status(status)
+
+# Feature toggles are module constants; format their status block once per (re)load
+_FEATURE_TOGGLE_BLOCK = "\n".join([
+    f"\n  Cấu Hình Chức Năng:",
+    f"    Sync User Info từ ERPNext: {'BẬT' if ENABLE_SYNC_USER_INFO_FROM_ERPNEXT_TO_DEVICE else 'TẮT'}",
+    f"    Xóa Template NV Nghỉ Việc (Devices): {'BẬT' if ENABLE_CLEAR_LEFT_USER_TEMPLATES_ON_DEVICES else 'TẮT'}",
+    f"    Xóa Template NV Nghỉ Việc (ERPNext): {'BẬT' if ENABLE_CLEAR_LEFT_USER_TEMPLATES_ON_ERPNEXT else 'TẮT'}",
+    f"    Chế độ Sync: {SYNC_USER_INFO_MODE}",
+    "=" * 60,
+])
 
 def log_bypass_status():
     """Log current bypass status"""
-    current_time = get_current_time()
-    status = get_bypass_status()
-    
-    print(f"\n[{current_time}] Cấu Hình Động:")
-    print("=" * 60)
-    
+    with cycle_tick():
+        current_time = get_current_time()
+        status = get_bypass_status()
+
+    lines = [f"\n[{current_time}] Cấu Hình Động:", "=" * 60]
+
     # Log sync status
     log_status = "BỎ QUA" if status['log_sync']['bypassed'] else "HOẠT ĐỘNG"
-    print(f"  Sync Log từ Device đến ERPNext: {log_status}")
+    lines.append(f"  Sync Log từ Device đến ERPNext: {log_status}")
     if status['log_sync']['bypassed']:
-        print(f"    Lý do: {status['log_sync']['reason']}")
+        lines.append(f"    Lý do: {status['log_sync']['reason']}")
         period = status['log_sync']['period']
-        print(f"    Thời gian: {period['start']} - {period['end']}")
-    
+        lines.append(f"    Thời gian: {period['start']} - {period['end']}")
+
     # User sync status
     user_status = "BỎ QUA" if status['user_sync']['bypassed'] else "HOẠT ĐỘNG"
-    print(f"  Sync User/Template từ ERPNext đến Device: {user_status}")
+    lines.append(f"  Sync User/Template từ ERPNext đến Device: {user_status}")
     if status['user_sync']['bypassed']:
-        print(f"    Lý do: {status['user_sync']['reason']}")
+        lines.append(f"    Lý do: {status['user_sync']['reason']}")
         period = status['user_sync']['period']
-        print(f"    Thời gian: {period['start']} - {period['end']}")
+        lines.append(f"    Thời gian: {period['start']} - {period['end']}")
 
     # Feature toggles
-    print(f"\n  Cấu Hình Chức Năng:")
-    print(f"    Sync User Info từ ERPNext: {'BẬT' if ENABLE_SYNC_USER_INFO_FROM_ERPNEXT_TO_DEVICE else 'TẮT'}")
-    print(f"    Xóa Template NV Nghỉ Việc (Devices): {'BẬT' if ENABLE_CLEAR_LEFT_USER_TEMPLATES_ON_DEVICES else 'TẮT'}")
-    print(f"    Xóa Template NV Nghỉ Việc (ERPNext): {'BẬT' if ENABLE_CLEAR_LEFT_USER_TEMPLATES_ON_ERPNEXT else 'TẮT'}")
-    print(f"    Chế độ Sync: {SYNC_USER_INFO_MODE}")
-    
-    print("=" * 60)
+    lines.append(_FEATURE_TOGGLE_BLOCK)
+    sys.stdout.write("\n".join(lines) + "\n")
 
 def log_operation_decision(operation, will_execute, reason=""):
     """Log decision for each operation"""
     status = "THỰC HIỆN" if will_execute else "BỎ QUA"
     timestamp = get_current_time()
-    print(f"[{timestamp}] {operation}: {status}")
+    message = f"[{timestamp}] {operation}: {status}"
     if reason:
-        print(f"    Lý do: {reason}")
+        message += f"\n    Lý do: {reason}"
+    print(message)
 
 def validate_time_periods():
     """Validate that time periods are properly formatted"""
-    all_periods = (sync_log_by_pass_period + sync_user_info_by_pass_period)
-
-    for period in all_periods:
+    for period in itertools.chain(sync_log_by_pass_period, sync_user_info_by_pass_period):
         try:
             datetime.datetime.strptime(period["start"], "%H:%M")
             datetime.datetime.strptime(period["end"], "%H:%M")
@@ -252,19 +329,33 @@ def validate_time_periods():
 
     return True
 
+# Parsed marker date, re-read only when the marker file's mtime changes.
+# Kept across importlib.reload() (the service reloads this module every cycle).
+_LAST_CLEAR_CACHE = globals().get('_LAST_CLEAR_CACHE', {"mtime": -1, "date": None})
+
 def get_last_clear_left_templates_date():
     """Get the last date when clear left templates was executed"""
     import os
 
     marker_file = os.path.join(LOGS_DIRECTORY, 'clean_data_employee_left', '.last_clear_left_templates')
-    if os.path.exists(marker_file):
-        try:
-            with open(marker_file, 'r') as f:
-                date_str = f.read().strip()
-                return datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-        except:
-            return None
-    return None
+    try:
+        mtime = os.stat(marker_file).st_mtime_ns
+    except OSError:
+        return None
+
+    if mtime == _LAST_CLEAR_CACHE["mtime"]:
+        return _LAST_CLEAR_CACHE["date"]
+
+    try:
+        with open(marker_file, 'r') as f:
+            date_str = f.read().strip()
+            last_date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
+    except:
+        return None
+
+    _LAST_CLEAR_CACHE["mtime"] = mtime
+    _LAST_CLEAR_CACHE["date"] = last_date
+    return last_date
 
 def set_last_clear_left_templates_date(date=None):
     """Set the last date when clear left templates was executed"""
@@ -274,11 +365,9 @@ def set_last_clear_left_templates_date(date=None):
         date = datetime.date.today()
 
     marker_file = os.path.join(LOGS_DIRECTORY, 'clean_data_employee_left', '.last_clear_left_templates')
-    marker_dir = os.path.dirname(marker_file)
-    os.makedirs(marker_dir, exist_ok=True)
-
     with open(marker_file, 'w') as f:
         f.write(date.strftime('%Y-%m-%d'))
+    _LAST_CLEAR_CACHE["mtime"] = -1
 
 def should_run_clear_left_templates():
     """Check if should run clear left templates (once per day on specific dates)
@@ -293,30 +382,56 @@ def should_run_clear_left_templates():
     if not ENABLE_CLEAR_LEFT_USER_TEMPLATES_ON_DEVICES:
         return False
 
-    last_run_date = get_last_clear_left_templates_date()
     today = datetime.date.today()
 
-    # Check if already run today
-    if last_run_date is not None and last_run_date >= today:
+    # Check date-of-month restriction first (no file access needed)
+    # If empty list [] → run every day
+    # If has values → only run on specified days
+    if CLEAR_LEFT_USER_TEMPLATES_ON_DATE_OF_MONTH and today.day not in CLEAR_LEFT_USER_TEMPLATES_ON_DATE_OF_MONTH:
         return False
 
-    # Check date-of-month restriction
-    # If empty list [] → run every day
-    if not CLEAR_LEFT_USER_TEMPLATES_ON_DATE_OF_MONTH:
-        return True
+    # Check if already run today
+    last_run_date = get_last_clear_left_templates_date()
+    return last_run_date is None or last_run_date < today
 
-    # If has values → only run on specified days
-    current_day = today.day
-    return current_day in CLEAR_LEFT_USER_TEMPLATES_ON_DATE_OF_MONTH
+def ensure_log_directories():
+    """Create the log directories used by config helpers (called once on import)"""
+    import os
+
+    for directory in (LOGS_DIRECTORY,
+                      os.path.join(LOGS_DIRECTORY, 'clean_data_employee_left'),
+                      os.path.dirname(CLEAR_LEFT_USER_TEMPLATES_LOG_FILE),
+                      os.path.dirname(PROCESSED_LEFT_EMPLOYEES_FILE)):
+        os.makedirs(directory, exist_ok=True)
 
 # Validate configuration on import
 validate_time_periods()
+ensure_log_directories()
+
+# Bypass periods as minute-of-day ranges (rebuilt whenever this module is reloaded)
+_SYNC_LOG_BYPASS_PERIODS = _compile_bypass_periods(sync_log_by_pass_period)
+_SYNC_USER_INFO_BYPASS_PERIODS = _compile_bypass_periods(sync_user_info_by_pass_period)
+_ANY_BYPASS_CONFIGURED = bool(_SYNC_LOG_BYPASS_PERIODS or _SYNC_USER_INFO_BYPASS_PERIODS)
 
 # =============================================================================
 # FINGER MAPPING UTILITIES
 # =============================================================================
 # Standardized finger mapping function for converting finger index to name
 
+# Finger names indexed by device finger index (0-9)
+_FINGER_NAMES = (
+    "Left Little",
+    "Left Ring",
+    "Left Middle",
+    "Left Index",
+    "Left Thumb",
+    "Right Thumb",
+    "Right Index",
+    "Right Middle",
+    "Right Ring",
+    "Right Little"
+)
+
 def get_finger_name(finger_index):
     """Get standardized finger name from index
 
@@ -326,19 +441,9 @@ def get_finger_name(finger_index):
     Returns:
         str: Standardized finger name
     """
-    finger_names = {
-        0: "Left Little",
-        1: "Left Ring",
-        2: "Left Middle",
-        3: "Left Index",
-        4: "Left Thumb",
-        5: "Right Thumb",
-        6: "Right Index",
-        7: "Right Middle",
-        8: "Right Ring",
-        9: "Right Little"
-    }
-    return finger_names.get(finger_index, f"Finger {finger_index}")
+    if type(finger_index) is int and 0 <= finger_index <= 9:
+        return _FINGER_NAMES[finger_index]
+    return f"Finger {finger_index}"
 
 
 # =============================================================================